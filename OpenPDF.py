@@ -1,11 +1,74 @@
 #!/usr/bin/env python3
-import sys, os, json
+import sys, os, json, time, queue, threading, hashlib, bisect, math, tempfile, argparse, importlib.util
+_MODULE_START = time.perf_counter()
+from array import array
+from collections import deque, OrderedDict
 from PyQt5 import QtCore, QtGui, QtWidgets
-from PyQt5.QtWidgets import QAction, QApplication, QMainWindow, QFileDialog, QColorDialog, QInputDialog, QGraphicsView, QGraphicsScene, QOpenGLWidget, QToolButton, QButtonGroup, QGraphicsPathItem, QGraphicsLineItem, QGraphicsRectItem, QGraphicsEllipseItem, QGraphicsTextItem, QToolBar, QStatusBar, QSlider, QDockWidget, QListWidget, QComboBox, QVBoxLayout, QWidget, QProgressDialog
+from PyQt5.QtWidgets import QAction, QApplication, QMainWindow, QFileDialog, QColorDialog, QInputDialog, QGraphicsView, QGraphicsScene, QOpenGLWidget, QToolButton, QButtonGroup, QGraphicsPathItem, QGraphicsLineItem, QGraphicsRectItem, QGraphicsEllipseItem, QGraphicsTextItem, QToolBar, QStatusBar, QSlider, QDockWidget, QListWidget, QVBoxLayout, QWidget, QProgressDialog
 from PyQt5.QtCore import QPropertyAnimation, QEasingCurve
-import fitz  # PyMuPDF
+
+def _lazy_import(name, package):
+    # The module is registered now but only executed on first attribute access
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ImportError(f"{package} is not installed; install it with 'pip install {package}'", name=name)
+    spec.loader = importlib.util.LazyLoader(spec.loader)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+fitz = _lazy_import("fitz", "PyMuPDF")  # loading it takes longer than building the window
+
+def _load_pymupdf():
+    # Runs the deferred import. An unrelated module named fitz (the PyPI 'fitz' package) would
+    # otherwise only fail later, as an AttributeError wherever PyMuPDF is first used.
+    try:
+        fitz.open
+    except AttributeError as e:
+        raise ImportError(f"The fitz module at {getattr(fitz, '__file__', '?')} is not PyMuPDF; "
+                          "install it with 'pip install PyMuPDF'", name="fitz") from e
 
 AUTOSAVE_INTERVAL = 60_000  # ms
+AUTOSAVE_IDLE_MS = 2000  # autosave waits until editing has paused this long
+UNDO_MEMORY_LIMIT = 64 * 1024 * 1024  # bytes
+PAGE_CACHE_LIMIT = 512 * 1024 * 1024  # bytes
+PIXMAP_MEMORY_BUDGET = 768 * 1024 * 1024  # bytes, shared by every open document
+PREFETCH_PAGES = 2
+DISPLAY_LIST_BUDGET = 256 * 1024 * 1024  # bytes of parsed page content kept for re-rendering
+DISPLAY_LIST_PAGE_COST = 256 * 1024  # bytes assumed for a page's parsed content, on top of its images
+DETAIL_LEVELS = (1.0, 1.5, 2.0)  # visible pages are re-rendered at these multiples of the base zoom as the view magnifies
+FLATTEN_MIN_ITEMS = 32  # pages with fewer shapes keep painting them as vectors
+FLATTEN_IDLE_MS = 1500
+TABLET_FRAME_MS = 16  # tablet moves are buffered and applied once per frame
+INK_MIN_WIDTH = 0.2  # stroke width at zero pressure, as a fraction of the pen width
+INK_WIDTH_LEVELS = 8  # distinct widths a pressure stroke is split into on export
+TEXT_CACHE_PAGES = 64  # pages whose glyph geometry is kept for selection
+TEXT_GRID = 24.0  # points, cell size of the per-page glyph lookup grid
+IMPORT_BATCH = 200  # native annotations converted to items per event-loop tick
+IMPORTED_LAYER = "Imported"
+OUTLINE_BATCH = 500  # outline entries read from the document per expansion step
+RENDER_ZOOM = 2.0  # scene units per PDF point
+EXPORT_DPI = 300
+IMAGE_FORMATS = {"png": "png", "jpeg": "jpg", "tiff": "tif"}  # format -> file extension
+DIFF_DPI = 96  # both revisions are rendered at this resolution for comparison
+DIFF_THRESHOLD = 48  # grey levels a pixel must move by to count as changed; absorbs anti-aliasing noise
+DIFF_TILE = 8  # pixels; changed regions are reported on a grid of this size
+# PDF export profiles: image downsampling (images above dpi_threshold are resampled to dpi_target and
+# re-encoded at quality), font subsetting, and the options handed to Document.save
+EXPORT_PROFILES = {
+    "fast": {"images": None, "subset_fonts": False,
+             "save": {"garbage": 1, "deflate": True}},
+    "balanced": {"images": {"dpi_threshold": 300, "dpi_target": 200, "quality": 85}, "subset_fonts": True,
+                 "save": {"garbage": 3, "deflate": True, "deflate_images": True, "deflate_fonts": True, "use_objstms": 1}},
+    "smallest": {"images": {"dpi_threshold": 150, "dpi_target": 110, "quality": 60}, "subset_fonts": True,
+                 "save": {"garbage": 4, "clean": True, "deflate": True, "deflate_images": True, "deflate_fonts": True,
+                          "use_objstms": 1, "compression_effort": 100}},
+}
+# Native annotation types that become editable items; the page raster is rendered without them.
+# These are fitz.PDF_ANNOT_INK, _LINE, _SQUARE, _CIRCLE, _FREE_TEXT, _TEXT and _HIGHLIGHT, spelled
+# out so that importing this module does not load PyMuPDF.
+NATIVE_ANNOT_TYPES = (15, 3, 4, 5, 2, 0, 8)
 
 class AnnotationSaveWorker(QtCore.QThread):
     saved = QtCore.pyqtSignal(str)
@@ -18,74 +81,1449 @@ class AnnotationSaveWorker(QtCore.QThread):
 
     def run(self):
         try:
-            with open(self.annotation_path, 'w') as f:
+            # Write beside the sidecar and rename over it, so a crash never leaves a truncated file
+            tmp = self.annotation_path + '.tmp'
+            with open(tmp, 'w') as f:
                 json.dump(self.annotations, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.annotation_path)
             self.saved.emit(self.annotation_path)
         except Exception as e:
             self.error.emit(str(e))
 
+def _apply_page_op(doc, op):
+    # Apply one page-structure edit to doc. Returns the new page order as old page numbers
+    # (None for inserted pages) and the new page numbers whose raster changes.
+    n = doc.page_count
+    kind = op[0]
+    if kind == "move":
+        _, src, dst = op
+        to = dst + 1 if dst > src else dst
+        doc.move_page(src, -1 if to >= n else to)
+        order = list(range(n))
+        order.insert(dst, order.pop(src))
+        return order, set()
+    if kind == "insert":
+        _, path, at = op
+        with fitz.open(path) as src:
+            doc.insert_pdf(src, start_at=at)
+            count = src.page_count
+        return list(range(at)) + [None] * count + list(range(at, n)), set(range(at, at + count))
+    if kind == "delete":
+        _, idx = op
+        doc.delete_page(idx)
+        return [i for i in range(n) if i != idx], set()
+    if kind == "rotate":
+        _, idx, angle = op
+        page = doc[idx]
+        page.set_rotation((page.rotation + angle) % 360)
+        return list(range(n)), {idx}
+    raise ValueError(f"Unknown page operation {kind}")
+
+def _derotated_strokes(strokes, m):
+    return [[tuple(fitz.Point(x, y) * m) for x, y in stroke] for stroke in strokes]
+
+def _annotated_doc(pdf_path, annotations, render_zoom, native_keys=(), page_ops=()):
+    # Opens pdf_path with the page edits replayed and the sidecar annotations written in as PDF annotations
+    doc = fitz.open(pdf_path)
+    for op in page_ops:
+        _apply_page_op(doc, op)
+    if native_keys:
+        # The editable copies in annotations take the place of the imported originals; dropping
+        # them from /Annots lets garbage collection remove them along with their popups
+        for page in doc:
+            xrefs = page.annot_xrefs()
+            dropped = {xref for xref, kind, _ in xrefs if kind in NATIVE_ANNOT_TYPES and _native_key(doc, xref, kind) in native_keys}
+            parents = {f"{xref} 0 R" for xref in dropped}
+            keep = [xref for xref, kind, _ in xrefs if xref not in dropped and
+                    not (kind == fitz.PDF_ANNOT_POPUP and doc.xref_get_key(xref, "Parent")[1] in parents)]
+            if len(keep) != len(xrefs):
+                doc.xref_set_key(page.xref, "Annots", "[%s]" % " ".join(f"{xref} 0 R" for xref in keep))
+    for ann in annotations:
+        page_idx = ann['page']
+        ann_type = ann['type']
+        page = doc[page_idx]
+        # Records are in the page's displayed (rotated) space; annotations are placed in unrotated page space
+        m = page.derotation_matrix
+        if ann_type == 'path' and 'pressure' in ann:
+            for width, runs in _ink_runs(ann['strokes'], ann['pressure'], ann['width']).items():
+                annot = page.add_ink_annot(_derotated_strokes(runs, m))
+                annot.set_colors(stroke=ann['color'])
+                annot.set_border(width=width / render_zoom)
+                annot.set_opacity(ann.get('opacity', 1.0))
+                annot.update()
+        elif ann_type == 'path':
+            strokes = ann['strokes']
+            color = ann['color']
+            width = ann['width']
+            annot = page.add_ink_annot(_derotated_strokes(strokes, m))
+            annot.set_colors(stroke=color)
+            annot.set_border(width=width / render_zoom)
+            annot.set_opacity(ann.get('opacity', 1.0))
+            annot.update()
+        elif ann_type == 'line':
+            x1, y1, x2, y2 = ann['points']
+            color = ann['color']
+            width = ann['width']
+            p1 = fitz.Point(x1, y1) * m
+            p2 = fitz.Point(x2, y2) * m
+            annot = page.add_line_annot(p1, p2)
+            annot.set_colors(stroke=color)
+            annot.set_border(width=width / render_zoom)
+            annot.update()
+        elif ann_type in ['rect', 'ellipse']:
+            x, y, w, h = ann['rect']
+            color = ann['color']
+            width = ann['width']
+            rect = fitz.Rect(x, y, x + w, y + h) * m
+            annot = page.add_rect_annot(rect) if ann_type == 'rect' else page.add_circle_annot(rect)
+            annot.set_colors(stroke=color)
+            annot.set_border(width=width / render_zoom)
+            annot.update()
+            # The border set after creation changes /RD; setting the rect again puts the stroke back on rect
+            annot.set_rect(rect)
+            annot.update()
+        elif ann_type == 'text':
+            x, y, text, font_size = ann['data']
+            color = ann['color']
+            # Records without a size come from the text tool or older sidecars
+            w, h = ann.get('size', (200, font_size * 1.5))
+            rect = fitz.Rect(x, y, x + w, y + h) * m
+            annot = page.add_freetext_annot(rect, text, fontsize=font_size / render_zoom, text_color=color,
+                                            rotate=(page.rotation + ann.get('rotate', 0)) % 360)
+            annot.update()
+        elif ann_type == 'comment':
+            x, y, comment = ann['data']
+            point = fitz.Point(x, y) * m
+            annot = page.add_text_annot(point, comment)
+            annot.update()
+        elif ann_type == 'highlight':
+            annot = page.add_highlight_annot(quads=[fitz.Rect(q) * m for q in ann['quads']])
+            annot.set_colors(stroke=ann['color'])
+            annot.set_opacity(ann.get('opacity', 1.0))
+            annot.update()
+    return doc
+
 class SaveWorker(QtCore.QThread):
     saved = QtCore.pyqtSignal(str)
+    report = QtCore.pyqtSignal(dict)
     error = QtCore.pyqtSignal(str)
     
-    def __init__(self, save_path, pdf_path, annotations, render_zoom, parent=None):
+    def __init__(self, save_path, pdf_path, annotations, render_zoom, parent=None, native_keys=(), page_ops=(),
+                 profile="balanced", linearize=False):
         super().__init__(parent)
         self.save_path = save_path
         self.pdf_path = pdf_path
         self.annotations = annotations
         self.render_zoom = render_zoom
+        self.native_keys = frozenset(native_keys)
+        self.page_ops = list(page_ops)
+        self.profile = profile
+        self.linearize = linearize
 
     def run(self):
         try:
-            doc = fitz.open(self.pdf_path)
-            for ann in self.annotations:
-                page_idx = ann['page']
-                ann_type = ann['type']
-                page = doc[page_idx]
-                if ann_type == 'path':
-                    strokes = ann['strokes']
-                    color = ann['color']
-                    width = ann['width']
-                    annot = page.add_ink_annot(strokes)
-                    annot.set_colors(stroke=color)
-                    annot.set_border(width=width / self.render_zoom)
-                    annot.update()
-                elif ann_type == 'line':
-                    x1, y1, x2, y2 = ann['points']
-                    color = ann['color']
-                    width = ann['width']
-                    p1 = fitz.Point(x1, y1)
-                    p2 = fitz.Point(x2, y2)
-                    annot = page.add_line_annot(p1, p2)
-                    annot.set_colors(stroke=color)
-                    annot.set_border(width=width / self.render_zoom)
-                    annot.update()
-                elif ann_type in ['rect', 'ellipse']:
-                    x, y, w, h = ann['rect']
-                    color = ann['color']
-                    width = ann['width']
-                    rect = fitz.Rect(x, y, x + w, y + h)
-                    annot = page.add_rect_annot(rect)
-                    annot.set_colors(stroke=color)
-                    annot.set_border(width=width / self.render_zoom)
-                    annot.update()
-                elif ann_type == 'text':
-                    x, y, text, font_size = ann['data']
-                    color = ann['color']
-                    rect = fitz.Rect(x, y, x + 200, y + font_size * 1.5)
-                    annot = page.add_freetext_annot(rect, text, fontsize=font_size / self.render_zoom, color=color)
-                    annot.update()
-                elif ann_type == 'comment':
-                    x, y, comment = ann['data']
-                    point = fitz.Point(x, y)
-                    annot = page.add_text_annot(point, comment)
-                    annot.update()
-            doc.save(self.save_path, garbage=4, deflate=True)
+            profile = EXPORT_PROFILES[self.profile]
+            stages = {}
+            clock = [time.perf_counter()]
+            def stage(name):
+                now = time.perf_counter()
+                stages[name] = (now - clock[0]) * 1000
+                clock[0] = now
+            doc = _annotated_doc(self.pdf_path, self.annotations, self.render_zoom, self.native_keys, self.page_ops)
+            stage("compose")
+            if profile["images"]:
+                doc.rewrite_images(**profile["images"])
+                stage("images")
+            if profile["subset_fonts"]:
+                doc.subset_fonts()
+                stage("fonts")
+            options = dict(profile["save"])
+            linearized = False
+            if self.linearize:
+                # MuPDF cannot combine object streams with linearization
+                options.pop("use_objstms", None)
+                try:
+                    doc.save(self.save_path, linear=True, **options)
+                    linearized = True
+                except Exception as e:
+                    # Newer MuPDF releases dropped linearization; fall back to a regular save
+                    if "inearis" not in str(e):
+                        raise
+            if not linearized:
+                doc.save(self.save_path, **options)
+            stage("save")
             doc.close()
+            self.report.emit({
+                "profile": self.profile, "linearized": linearized,
+                "input_bytes": os.path.getsize(self.pdf_path), "output_bytes": os.path.getsize(self.save_path),
+                "stages_ms": stages, "total_ms": sum(stages.values()),
+            })
             self.saved.emit(self.save_path)
         except Exception as e:
             self.error.emit(str(e))
 
+def _pool_results(thread, jobs, initializer, initargs, fn, tasks):
+    # Runs fn(*args) for each args in tasks on a process pool and yields results as they finish.
+    # spawn keeps the pool independent of this process's Qt threads; at most two tasks per process
+    # are in flight, so memory stays flat however many there are, and none start once thread is interrupted.
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+    tasks = iter(tasks)
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(jobs, mp_context=ctx, initializer=initializer, initargs=initargs) as pool:
+        pending = set()
+        while True:
+            while len(pending) < jobs * 2 and not thread.isInterruptionRequested():
+                args = next(tasks, None)
+                if args is None:
+                    break
+                pending.add(pool.submit(fn, *args))
+            if not pending:
+                return
+            finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                yield future.result()
+
+_raster_doc = None
+
+def _raster_init(pdf_path):
+    global _raster_doc
+    _raster_doc = fitz.open(pdf_path)
+
+def _raster_page(idx, dest, dpi, fmt, quality):
+    # Runs in a pool process, which holds one page's pixmap at a time
+    start = time.perf_counter()
+    pix = _raster_doc[idx].get_pixmap(dpi=dpi, alpha=False)
+    if fmt == "tiff":
+        # PyMuPDF has no TIFF writer; Qt's image plugins do
+        image = QtGui.QImage(pix.samples, pix.width, pix.height, pix.stride, QtGui.QImage.Format_RGB888)
+        if not image.save(dest, "TIFF"):
+            raise OSError(f"Could not write {dest}")
+    else:
+        pix.save(dest, output=IMAGE_FORMATS[fmt], jpg_quality=quality)
+    return idx, dest, time.perf_counter() - start
+
+class ImageExportWorker(QtCore.QThread):
+    # Composites the annotations into a scratch PDF once, then rasterizes its pages across a process pool
+    page_done = QtCore.pyqtSignal(int, str, float)
+    progress = QtCore.pyqtSignal(int, int)
+    exported = QtCore.pyqtSignal(dict)
+    error = QtCore.pyqtSignal(str)
+
+    def __init__(self, out_dir, pdf_path, annotations, render_zoom, parent=None, native_keys=(), page_ops=(),
+                 dpi=EXPORT_DPI, fmt="png", quality=90, jobs=None):
+        super().__init__(parent)
+        self.out_dir = out_dir
+        self.pdf_path = pdf_path
+        self.annotations = annotations
+        self.render_zoom = render_zoom
+        self.native_keys = frozenset(native_keys)
+        self.page_ops = list(page_ops)
+        self.dpi = dpi
+        self.fmt = fmt
+        self.quality = quality
+        self.jobs = jobs or os.cpu_count() or 1
+
+    def run(self):
+        scratch = None
+        try:
+            start = time.perf_counter()
+            source = self.pdf_path
+            if self.annotations or self.page_ops or self.native_keys:
+                doc = _annotated_doc(self.pdf_path, self.annotations, self.render_zoom, self.native_keys, self.page_ops)
+                fd, scratch = tempfile.mkstemp(suffix=".pdf")
+                os.close(fd)
+                doc.save(scratch)
+                doc.close()
+                source = scratch
+            with fitz.open(source) as doc:
+                count = doc.page_count
+            compose = time.perf_counter() - start
+            stem = os.path.splitext(os.path.basename(self.pdf_path))[0]
+            digits = len(str(count))
+            ext = IMAGE_FORMATS[self.fmt]
+            os.makedirs(self.out_dir, exist_ok=True)
+            timings = [0.0] * count
+            done = 0
+            tasks = ((idx, os.path.join(self.out_dir, f"{stem}-{idx + 1:0{digits}d}.{ext}"), self.dpi, self.fmt, self.quality)
+                     for idx in range(count))
+            for idx, dest, seconds in _pool_results(self, self.jobs, _raster_init, (source,), _raster_page, tasks):
+                timings[idx] = seconds
+                done += 1
+                self.page_done.emit(idx, dest, seconds)
+                self.progress.emit(done, count)
+            wall = time.perf_counter() - start
+            self.exported.emit({
+                "pages": done, "of": count, "dpi": self.dpi, "format": self.fmt, "jobs": self.jobs,
+                "compose_s": compose, "wall_s": wall, "pages_per_s": done / wall if wall else 0.0,
+                "page_ms": _percentiles([t for t in timings if t]),
+                "per_page_ms": [round(t * 1000, 2) for t in timings],
+            })
+        except Exception as e:
+            self.error.emit(str(e))
+        finally:
+            if scratch:
+                os.remove(scratch)
+
+_diff_docs = None
+
+def _diff_init(path_a, path_b):
+    global _diff_docs
+    _diff_docs = (fitz.open(path_a), fitz.open(path_b))
+
+def _grey_page(doc, idx, dpi):
+    import numpy as np
+    if idx >= doc.page_count:
+        return None
+    pix = doc[idx].get_pixmap(dpi=dpi, colorspace=fitz.csGRAY, alpha=False)
+    return np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.stride)[:, :pix.width]
+
+def _diff_page(idx, dpi, threshold, tile):
+    # Runs in a pool process. Returns the changed fraction of page idx and the changed
+    # regions as [x0, y0, x1, y1] rectangles in page points, one per run of changed tiles in a row.
+    import numpy as np
+    start = time.perf_counter()
+    a, b = (_grey_page(doc, idx, dpi) for doc in _diff_docs)
+    if a is None or b is None:
+        # A page only one revision has is changed throughout
+        mask = np.ones((a if b is None else b).shape, bool)
+    else:
+        # Both are padded white to a common size, so a resized page shows its new margin as changed
+        h, w = max(a.shape[0], b.shape[0]), max(a.shape[1], b.shape[1])
+        pa = np.full((h, w), 255, np.int16)
+        pa[:a.shape[0], :a.shape[1]] = a
+        pb = np.full((h, w), 255, np.int16)
+        pb[:b.shape[0], :b.shape[1]] = b
+        mask = np.abs(pa - pb) > threshold
+    ratio = float(mask.mean())
+    rects = []
+    if ratio:
+        h, w = mask.shape
+        rows, cols = -(-h // tile), -(-w // tile)
+        grid = np.zeros((rows * tile, cols * tile), bool)
+        grid[:h, :w] = mask
+        tiles = grid.reshape(rows, tile, cols, tile).any(axis=(1, 3))
+        edges = np.diff(np.pad(tiles.astype(np.int8), ((0, 0), (1, 1))), axis=1)
+        starts, ends = np.argwhere(edges == 1), np.argwhere(edges == -1)
+        scale = 72.0 / dpi * tile
+        rects = (np.stack([starts[:, 1], starts[:, 0], ends[:, 1], starts[:, 0] + 1], axis=1) * scale).tolist()
+    return idx, ratio, rects, time.perf_counter() - start
+
+class DiffWorker(QtCore.QThread):
+    # Compares two PDFs page by page at the same resolution across a process pool
+    page_diffed = QtCore.pyqtSignal(int, float, list)
+    progress = QtCore.pyqtSignal(int, int)
+    compared = QtCore.pyqtSignal(dict)
+    error = QtCore.pyqtSignal(str)
+
+    def __init__(self, path_a, path_b, parent=None, dpi=DIFF_DPI, threshold=DIFF_THRESHOLD, jobs=None):
+        super().__init__(parent)
+        self.path_a = path_a
+        self.path_b = path_b
+        self.dpi = dpi
+        self.threshold = threshold
+        self.jobs = jobs or os.cpu_count() or 1
+
+    def run(self):
+        try:
+            start = time.perf_counter()
+            with fitz.open(self.path_a) as a, fitz.open(self.path_b) as b:
+                counts = (a.page_count, b.page_count)
+            count = max(counts)
+            ratios = {}
+            timings = []
+            tasks = ((idx, self.dpi, self.threshold, DIFF_TILE) for idx in range(count))
+            for idx, ratio, rects, seconds in _pool_results(self, self.jobs, _diff_init, (self.path_a, self.path_b), _diff_page, tasks):
+                ratios[idx] = ratio
+                timings.append(seconds)
+                self.page_diffed.emit(idx, ratio, rects)
+                self.progress.emit(len(ratios), count)
+            wall = time.perf_counter() - start
+            ranking = sorted((idx for idx in ratios if ratios[idx]), key=lambda idx: -ratios[idx])
+            self.compared.emit({
+                "pages": len(ratios), "of": count, "page_counts": counts, "changed_pages": len(ranking),
+                "ranking": [[idx, ratios[idx]] for idx in ranking], "dpi": self.dpi, "jobs": self.jobs,
+                "wall_s": wall, "page_ms": _percentiles(timings),
+            })
+        except Exception as e:
+            self.error.emit(str(e))
+
+def _pdf_numbers(value):
+    return [float(v) for v in value.replace('[', ' ').replace(']', ' ').split()]
+
+def _native_record(doc, page, xref, kind, zoom):
+    # Convert a PDF annotation into the sidecar record format read by _annotation_item.
+    # Keys are read straight from the annotation dictionary: going through page.annots()
+    # re-resolves every annotation and gets quadratic on pages holding thousands of them.
+    def key(name):
+        return doc.xref_get_key(xref, name)[1]
+    # PDF user space to the page's displayed space, which includes its /Rotate
+    m = page.transformation_matrix * page.rotation_matrix
+    def point(x, y):
+        p = fitz.Point(x, y) * m
+        return [p.x, p.y]
+    color = _pdf_numbers(key("C")) if key("C") != 'null' else []
+    color = color * 3 if len(color) == 1 else color
+    color = color if len(color) == 3 else [0.0, 0.0, 0.0]
+    width = float(key("BS/W")) if key("BS/W") != 'null' else 1.0
+    width = (width if width > 0 else 1.0) * zoom
+    record = {'layer': IMPORTED_LAYER, 'page': page.number, 'color': color, 'width': width}
+    r = fitz.Rect(_pdf_numbers(key("Rect"))) * m
+    if kind == fitz.PDF_ANNOT_INK:
+        strokes = []
+        for chunk in key("InkList").split(']'):
+            values = _pdf_numbers(chunk)
+            if len(values) >= 2:
+                strokes.append([point(values[i], values[i + 1]) for i in range(0, len(values) - 1, 2)])
+        if not strokes:
+            return None
+        record.update(type='path', strokes=strokes)
+    elif kind == fitz.PDF_ANNOT_LINE:
+        x1, y1, x2, y2 = _pdf_numbers(key("L"))[:4]
+        record.update(type='line', points=point(x1, y1) + point(x2, y2))
+    elif kind in (fitz.PDF_ANNOT_SQUARE, fitz.PDF_ANNOT_CIRCLE):
+        # /Rect includes the border; the stroke runs along /Rect inset by /RD, or by half the width without one
+        x0, y0, x1, y1 = _pdf_numbers(key("Rect"))[:4]
+        rd = _pdf_numbers(key("RD")) if key("RD") != 'null' else []
+        left, top, right, bottom = rd[:4] if len(rd) >= 4 else [width / zoom / 2] * 4
+        r = fitz.Rect(x0 + left, y0 + bottom, x1 - right, y1 - top) * m
+        record.update(type='rect' if kind == fitz.PDF_ANNOT_SQUARE else 'ellipse', rect=[r.x0, r.y0, r.width, r.height])
+    elif kind == fitz.PDF_ANNOT_FREE_TEXT:
+        font_size = 12.0
+        da = key("DA").split()
+        if "Tf" in da:
+            font_size = float(da[da.index("Tf") - 1])
+        if "rg" in da:
+            i = da.index("rg")
+            record['color'] = [float(v) for v in da[i - 3:i]]
+        text = key("Contents")
+        record.update(type='text', data=[r.x0, r.y0, '' if text == 'null' else text, font_size * zoom], size=[r.width, r.height])
+        # /Rotate turns the text within the page's unrotated space; keep its angle on the displayed page
+        rotate = (int(key("Rotate")) if key("Rotate") != 'null' else 0) - page.rotation
+        if rotate % 360:
+            record['rotate'] = rotate % 360
+    elif kind == fitz.PDF_ANNOT_TEXT:
+        text = key("Contents")
+        record.update(type='comment', data=[r.x0, r.y0, '' if text == 'null' else text])
+    elif kind == fitz.PDF_ANNOT_HIGHLIGHT:
+        values = _pdf_numbers(key("QuadPoints"))
+        quads = []
+        for i in range(0, len(values) - 7, 8):
+            q = fitz.Rect(fitz.Point(values[i], values[i + 1]) * m, fitz.Point(values[i + 6], values[i + 7]) * m)
+            q.normalize()
+            quads.append([q.x0, q.y0, q.x1, q.y1])
+        if not quads:
+            return None
+        # Highlights are drawn translucent here rather than with a multiply blend
+        opacity = float(key("CA")) if key("CA") != 'null' else 1.0
+        record.update(type='highlight', quads=quads, opacity=min(opacity, 0.5))
+    else:
+        return None
+    return record
+
+def _native_converted(doc, page, xref, kind):
+    # Only annotations that convert to a record are replaced; the rest stay in the PDF as they are
+    if kind not in NATIVE_ANNOT_TYPES:
+        return False
+    try:
+        return _native_record(doc, page, xref, kind, 1.0) is not None
+    except (ValueError, IndexError):
+        return False
+
+def _native_key(doc, xref, kind):
+    # Names a PDF annotation independently of its xref and page number, which page edits change.
+    # /NM alone is not enough: writers number them per file, so inserted pages can repeat a name.
+    name = doc.xref_get_key(xref, "NM")
+    name = name[1] if name[0] == 'string' else ""
+    return f"{kind}:{name}:{doc.xref_get_key(xref, 'Rect')[1]}"
+
+def _native_keys(doc):
+    return {_native_key(doc, xref, kind) for page in doc for xref, kind, _ in page.annot_xrefs()
+            if _native_converted(doc, page, xref, kind)}
+
+class AnnotationImportWorker(QtCore.QThread):
+    # Streams the annotations already stored in a PDF as sidecar records, page by page, on its own document.
+    # Every record carries the 'native_key' of its original; annotations in known are skipped. With adopt,
+    # records hold only the key: the sidecar predates per-annotation tracking and already has the items.
+    batch = QtCore.pyqtSignal(list)
+    error = QtCore.pyqtSignal(str)
+
+    def __init__(self, pdf_path, render_zoom, parent=None, start_at=0, known=(), adopt=False):
+        super().__init__(parent)
+        self.pdf_path = pdf_path
+        self.render_zoom = render_zoom
+        self.start_at = start_at  # where the file's first page sits in the open document
+        self.known = frozenset(known)
+        self.adopt = adopt
+
+    def run(self):
+        try:
+            doc = fitz.open(self.pdf_path)
+            for page in doc:
+                records = []
+                for xref, kind, _ in page.annot_xrefs():
+                    if self.isInterruptionRequested():
+                        break
+                    if kind not in NATIVE_ANNOT_TYPES:
+                        continue
+                    key = _native_key(doc, xref, kind)
+                    if key in self.known:
+                        continue
+                    if self.adopt:
+                        record = {'page': page.number} if _native_converted(doc, page, xref, kind) else None
+                    else:
+                        try:
+                            record = _native_record(doc, page, xref, kind, self.render_zoom)
+                        except (ValueError, IndexError):
+                            record = None
+                    if record:
+                        record['page'] += self.start_at
+                        record['native_key'] = key
+                        records.append(record)
+                    if len(records) >= IMPORT_BATCH:
+                        self.batch.emit(records)
+                        records = []
+                if self.isInterruptionRequested():
+                    break
+                if records:
+                    self.batch.emit(records)
+            doc.close()
+        except Exception as e:
+            self.error.emit(str(e))
+
+class PageSaveWorker(QtCore.QThread):
+    # Replays page-structure edits on a fresh copy of the file and writes them back, appending
+    # an incremental update when the file allows it instead of rewriting every page
+    saved = QtCore.pyqtSignal(str)
+    error = QtCore.pyqtSignal(str)
+
+    def __init__(self, pdf_path, page_ops, parent=None):
+        super().__init__(parent)
+        self.pdf_path = pdf_path
+        self.page_ops = list(page_ops)
+
+    def run(self):
+        try:
+            doc = fitz.open(self.pdf_path)
+            for op in self.page_ops:
+                _apply_page_op(doc, op)
+            if doc.can_save_incrementally():
+                doc.save(self.pdf_path, incremental=True, encryption=fitz.PDF_ENCRYPT_KEEP)
+                doc.close()
+            else:
+                tmp = self.pdf_path + '.tmp'
+                doc.save(tmp, garbage=1, deflate=True)
+                doc.close()
+                os.replace(tmp, self.pdf_path)
+            self.saved.emit(self.pdf_path)
+        except Exception as e:
+            self.error.emit(str(e))
+
+class PageCacheWriter(QtCore.QThread):
+    # Encodes rendered pages to disk off the GUI thread and trims the cache to its size limit
+    error = QtCore.pyqtSignal(str)
+
+    def __init__(self, cache, parent=None):
+        super().__init__(parent)
+        self.cache = cache
+        self.jobs = queue.Queue()
+
+    def run(self):
+        written = 0
+        try:
+            self.cache.trim()  # indexes what earlier sessions left on disk
+        except Exception as e:
+            self.error.emit(str(e))
+        while True:
+            job = self.jobs.get()
+            try:
+                if job is None:
+                    return
+                path, image = job
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                tmp = path + '.tmp'
+                if image.save(tmp, "PNG"):
+                    os.replace(tmp, path)
+                    self.cache.added(path, os.path.getsize(path))
+                    written += 1
+                else:
+                    raise OSError(f"could not write {tmp}")
+                if self.jobs.empty() or written % 32 == 0:
+                    self.cache.trim()
+            except Exception as e:
+                self.error.emit(str(e))
+            finally:
+                self.jobs.task_done()
+
+class PageCache:
+    # Rendered pages on disk as PNG, keyed by file identity, page, zoom and color mode.
+    # Reads bump the file mtime so the next session's index still puts least recently used pages first.
+    def __init__(self, directory, limit=PAGE_CACHE_LIMIT, on_error=None):
+        self.directory = directory
+        self.limit = limit
+        self.on_error = on_error
+        self._writer = None
+        self._lock = threading.Lock()  # the index is shared by GUI-thread loads and the writer
+        self._index = None  # path -> size, least recently used first; the writer builds it from disk once
+        self._size = 0
+
+    def doc_key(self, path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        ident = f"{os.path.abspath(path)}|{st.st_size}|{st.st_mtime_ns}|no-native-annots"
+        return hashlib.sha1(ident.encode('utf-8')).hexdigest()
+
+    def _path(self, doc_key, page_idx, zoom, mode):
+        return os.path.join(self.directory, doc_key, f"{page_idx}-{zoom:g}-{mode}.png")
+
+    def load(self, doc_key, page_idx, zoom, mode):
+        path = self._path(doc_key, page_idx, zoom, mode)
+        if not os.path.exists(path):
+            return None
+        image = QtGui.QImage(path)
+        if image.isNull():
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        with self._lock:
+            if self._index is not None and path in self._index:
+                self._index.move_to_end(path)
+        return image
+
+    def store(self, doc_key, page_idx, zoom, mode, image):
+        if self.limit <= 0:
+            return
+        if self._writer is None:
+            self._writer = PageCacheWriter(self)
+            self._writer.error.connect(self.on_error or (lambda err: print(f"Failed to write page cache: {err}", file=sys.stderr)))
+            self._writer.start()
+        self._writer.jobs.put((self._path(doc_key, page_idx, zoom, mode), image))
+
+    def _scan(self):
+        # Runs once, on the writer thread, without the lock so loads are not held up by the walk
+        entries = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, path, st.st_size))
+        entries.sort()
+        index = OrderedDict((path, size) for _, path, size in entries)
+        with self._lock:
+            self._index, self._size = index, sum(index.values())
+
+    def added(self, path, size):
+        with self._lock:
+            if self._index is None:
+                return
+            self._size += size - self._index.pop(path, 0)
+            self._index[path] = size
+
+    def trim(self):
+        if self._index is None:
+            self._scan()
+        with self._lock:
+            while self._size > self.limit and self._index:
+                path, size = self._index.popitem(last=False)
+                self._size -= size
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def flush(self):
+        if self._writer:
+            self._writer.jobs.join()
+
+    def close(self):
+        if self._writer:
+            self._writer.jobs.put(None)
+            self._writer.wait()
+            self._writer = None
+
+def _ink_width(width, pressure):
+    return width * (INK_MIN_WIDTH + (1 - INK_MIN_WIDTH) * pressure)
+
+def _ink_runs(strokes, pressures, width):
+    # PDF ink annotations have a single border width, so a pressure stroke is cut into runs
+    # of similar width and every width becomes one annotation holding all of its runs. Each
+    # width is the heaviest pressure actually drawn at that level, so full pressure stays full width.
+    def level(p):
+        return min(int(p * INK_WIDTH_LEVELS), INK_WIDTH_LEVELS - 1)
+    runs, peaks = {}, {}
+    for stroke, stroke_pressure in zip(strokes, pressures):
+        for p in stroke_pressure:
+            peaks[level(p)] = max(peaks.get(level(p), 0.0), p)
+        current, run = level(stroke_pressure[0]), [stroke[0]]
+        for point, p in zip(stroke[1:], stroke_pressure[1:]):
+            run.append(point)
+            if level(p) != current:
+                runs.setdefault(current, []).append(run)
+                current, run = level(p), [point]
+        if len(run) > 1 or len(stroke) == 1:
+            runs.setdefault(current, []).append(run)
+    return {_ink_width(width, peaks[lvl]): r for lvl, r in runs.items()}
+
+class InkStrokeItem(QGraphicsPathItem):
+    # Pen stroke kept as a flat x, y, pressure float array and painted as a filled variable-width outline.
+    # The outline is one quad per segment between the edge points of its two samples. A sample's edge
+    # points are final once the next sample arrives, so the path only ever grows at its end; the last
+    # segment and the end cap are added by finish() when the stroke is complete.
+    def __init__(self, color, width):
+        super().__init__()
+        self.points = array('f')
+        self.base_width = width
+        self._edge = None  # (left, right) of the last sample with a final outline
+        self.setPen(QtGui.QPen(QtCore.Qt.NoPen))
+        self.setBrush(color)
+        self._reset_path()
+
+    def color(self):
+        return self.brush().color()
+
+    def _reset_path(self):
+        path = QtGui.QPainterPath()
+        path.setFillRule(QtCore.Qt.WindingFill)
+        self.setPath(path)
+        self._edge = None
+
+    def map_points(self, transform):
+        points = self.points
+        self.points = array('f')
+        self._reset_path()
+        mapped = []
+        for i in range(0, len(points), 3):
+            p = transform.map(QtCore.QPointF(points[i], points[i + 1]))
+            mapped.append((p.x(), p.y(), points[i + 2]))
+        self.add_points(mapped)
+        self.finish()
+
+    def _edge_points(self, i, n):
+        # Offsets sample i across the direction between its neighbours by half its pressure width
+        points = self.points
+        a, b = max(i - 1, 0), min(i + 1, n - 1)
+        dx, dy = points[3 * b] - points[3 * a], points[3 * b + 1] - points[3 * a + 1]
+        length = math.hypot(dx, dy) or 1.0
+        r = _ink_width(self.base_width, points[3 * i + 2]) / 2
+        nx, ny = -dy / length * r, dx / length * r
+        x, y = points[3 * i], points[3 * i + 1]
+        return QtCore.QPointF(x + nx, y + ny), QtCore.QPointF(x - nx, y - ny)
+
+    def _cap(self, path, i):
+        r = _ink_width(self.base_width, self.points[3 * i + 2]) / 2
+        path.addEllipse(QtCore.QPointF(self.points[3 * i], self.points[3 * i + 1]), r, r)
+
+    def _extend(self, path, edge):
+        if self._edge:
+            (left_a, right_a), (left_b, right_b) = self._edge, edge
+            path.addPolygon(QtGui.QPolygonF([left_a, left_b, right_b, right_a]))
+            path.closeSubpath()
+        self._edge = edge
+
+    def _grow(self, add):
+        # Take the path out of the item first so it is the only reference and appends happen in place
+        path = self.path()
+        self.setPath(QtGui.QPainterPath())
+        add(path)
+        self.setPath(path)
+
+    def add_points(self, samples):
+        def add(path):
+            for x, y, pressure in samples:
+                self.points.extend((x, y, pressure))
+                n = len(self.points) // 3
+                if n == 1:
+                    self._cap(path, 0)
+                else:
+                    self._extend(path, self._edge_points(n - 2, n))
+        self._grow(add)
+
+    def finish(self):
+        n = len(self.points) // 3
+        if n < 2:
+            return
+        def add(path):
+            self._extend(path, self._edge_points(n - 1, n))
+            self._cap(path, n - 1)
+        self._grow(add)
+
+class HighlightItem(QGraphicsPathItem):
+    # Text highlight made of one rectangle per selected line, in page-local coordinates
+    def __init__(self, color, quads):
+        super().__init__()
+        self.setPen(QtGui.QPen(QtCore.Qt.NoPen))
+        self.setBrush(color)
+        self.set_quads(quads)
+
+    def color(self):
+        return self.brush().color()
+
+    def set_quads(self, quads):
+        self.quads = [QtCore.QRectF(q) for q in quads]
+        path = QtGui.QPainterPath()
+        path.setFillRule(QtCore.Qt.WindingFill)
+        for q in self.quads:
+            path.addRect(q)
+        self.setPath(path)
+
+class PageText:
+    # Glyph geometry of one page in flat arrays: 4 floats per character box plus the
+    # character, its line and word number. A coarse grid of character centres answers
+    # hit tests without scanning the page.
+    def __init__(self, page):
+        self.boxes = array('f')
+        self.lines = array('i')
+        self.words = array('i')
+        self.grid = {}
+        chars = []
+        line_no = word_no = 0
+        # Text is extracted in unrotated page space; the page is displayed rotated
+        m = page.rotation_matrix if page.rotation else None
+        for block in page.get_text("rawdict")["blocks"]:
+            for line in block.get("lines", ()):
+                for span in line["spans"]:
+                    for ch in span["chars"]:
+                        x0, y0, x1, y1 = ch["bbox"] if m is None else fitz.Rect(ch["bbox"]) * m
+                        # A space is a word of its own, so snapping never pulls it into a neighbour
+                        space = ch["c"].isspace()
+                        if space:
+                            word_no += 1
+                        cell = (int((x0 + x1) / 2 // TEXT_GRID), int((y0 + y1) / 2 // TEXT_GRID))
+                        self.grid.setdefault(cell, array('i')).append(len(chars))
+                        chars.append(ch["c"])
+                        self.boxes.extend((x0, y0, x1, y1))
+                        self.lines.append(line_no)
+                        self.words.append(word_no)
+                        if space:
+                            word_no += 1
+                line_no += 1
+                word_no += 1
+        self.text = "".join(chars)
+
+    def hit(self, x, y, reach=2):
+        # Nearest character to (x, y) in page points, searching rings of grid cells outwards
+        cx, cy = int(x // TEXT_GRID), int(y // TEXT_GRID)
+        best, best_dist = None, None
+        for ring in range(reach + 1):
+            for gx in range(cx - ring, cx + ring + 1):
+                for gy in range(cy - ring, cy + ring + 1):
+                    if max(abs(gx - cx), abs(gy - cy)) != ring:
+                        continue
+                    for i in self.grid.get((gx, gy), ()):
+                        x0, y0, x1, y1 = self.boxes[4 * i:4 * i + 4]
+                        dist = max(x0 - x, 0, x - x1) ** 2 + max(y0 - y, 0, y - y1) ** 2
+                        if best_dist is None or dist < best_dist:
+                            best, best_dist = i, dist
+            if best is not None and ring:
+                break
+        return best
+
+    def snap_to_words(self, start, end):
+        while start > 0 and self.words[start - 1] == self.words[start]:
+            start -= 1
+        while end + 1 < len(self.text) and self.words[end + 1] == self.words[end]:
+            end += 1
+        return start, end
+
+    def selected_text(self, start, end):
+        parts = []
+        for i in range(start, end + 1):
+            if i > start and self.lines[i] != self.lines[i - 1]:
+                parts.append("\n")
+            parts.append(self.text[i])
+        return "".join(parts)
+
+    def quads(self, start, end):
+        # One rectangle per line covered by the character range
+        quads = []
+        for i in range(start, end + 1):
+            x0, y0, x1, y1 = self.boxes[4 * i:4 * i + 4]
+            if quads and self.lines[i] == self.lines[i - 1]:
+                q = quads[-1]
+                q[0], q[1], q[2], q[3] = min(q[0], x0), min(q[1], y0), max(q[2], x1), max(q[3], y1)
+            else:
+                quads.append([x0, y0, x1, y1])
+        return quads
+
+def _page_resource_bytes(page):
+    # Images and forms stay compressed in a display list until rendered, so their /Length is what it
+    # keeps alive. Only the resource dictionaries are read; content streams are covered by the fixed cost.
+    doc = page.parent
+    xrefs = {x[0] for x in page.get_xobjects()}
+    xrefs.update(x[0] for x in page.get_images())
+    size = 0
+    for xref in xrefs:
+        kind, value = doc.xref_get_key(xref, "Length")
+        if kind == 'xref':
+            value = doc.xref_object(int(value.split()[0]))
+        try:
+            size += int(value)
+        except ValueError:
+            pass
+    return size
+
+class DisplayListCache:
+    # Parsed page content per (tab, page). Rasterizing from a fitz.DisplayList skips interpreting
+    # the content stream, so rendering a page again at another zoom only pays for the pixels.
+    # Sizes are a fixed cost per page plus the stored size of its images and forms; least recently used lists go first.
+    def __init__(self, budget=DISPLAY_LIST_BUDGET):
+        self.budget = budget
+        self.lists = OrderedDict()  # (tab, page_idx) -> (DisplayList, bytes)
+        self.memory_used = 0
+
+    def get(self, tab, page_idx):
+        entry = self.lists.get((tab, page_idx))
+        if entry is None:
+            return None
+        self.lists.move_to_end((tab, page_idx))
+        return entry[0]
+
+    def add(self, tab, page_idx, page):
+        self.forget(tab, page_idx)
+        dlist = page.get_displaylist()
+        size = _page_resource_bytes(page) + DISPLAY_LIST_PAGE_COST
+        self.lists[(tab, page_idx)] = (dlist, size)
+        self.memory_used += size
+        while self.memory_used > self.budget and len(self.lists) > 1:
+            _, (_, freed) = self.lists.popitem(last=False)
+            self.memory_used -= freed
+        return dlist
+
+    def forget(self, tab, page_idx):
+        entry = self.lists.pop((tab, page_idx), None)
+        if entry:
+            self.memory_used -= entry[1]
+
+    def remap(self, tab, mapping):
+        # Same contract as RenderScheduler.remap; a moved page keeps its parsed content
+        lists = OrderedDict()
+        for key, entry in self.lists.items():
+            if key[0] is not tab:
+                lists[key] = entry
+            elif key[1] in mapping:
+                lists[(tab, mapping[key[1]])] = entry
+            else:
+                self.memory_used -= entry[1]
+        self.lists = lists
+
+    def release(self, tab):
+        for key in [key for key in self.lists if key[0] is tab]:
+            self.memory_used -= self.lists.pop(key)[1]
+
+class TextCache:
+    # PageText per (tab, page), extracted the first time a page is selected from, least recently used evicted
+    def __init__(self, limit=TEXT_CACHE_PAGES):
+        self.limit = limit
+        self.pages = OrderedDict()
+
+    def get(self, tab, page_idx):
+        key = (tab, page_idx)
+        text = self.pages.get(key)
+        if text is None:
+            text = self.pages[key] = PageText(tab.doc.load_page(page_idx))
+            while len(self.pages) > self.limit:
+                self.pages.popitem(last=False)
+        else:
+            self.pages.move_to_end(key)
+        return text
+
+    def release(self, tab):
+        for key in [key for key in self.pages if key[0] is tab]:
+            del self.pages[key]
+
+def _event_pos(ev):
+    # Tablet events (and replayed ones) carry subpixel positions; mouse events only whole pixels
+    pos_f = getattr(ev, "posF", None)
+    return pos_f() if pos_f else QtCore.QPointF(ev.pos())
+
+def _event_pressure(ev):
+    # Mouse events carry no pressure and draw at full pen width
+    pressure = getattr(ev, "pressure", None)
+    return pressure() if pressure else 1.0
+
+def _item_cost(item):
+    # Rough estimate of what a history entry keeps alive, used for the undo memory cap
+    if isinstance(item, InkStrokeItem):
+        return 256 + len(item.points) * 4 + item.path().elementCount() * 32
+    if isinstance(item, QGraphicsPathItem):
+        return 256 + item.path().elementCount() * 32
+    if isinstance(item, QGraphicsTextItem):
+        return 256 + len(item.toPlainText()) * 2
+    return 256
+
+class UndoStack:
+    # Each gesture is one transaction: a list of ("add" | "remove", item, page_idx, layer) ops.
+    # Oldest transactions are evicted once the estimated memory exceeds memory_limit.
+    def __init__(self, memory_limit=UNDO_MEMORY_LIMIT):
+        self.memory_limit = memory_limit
+        self.memory_used = 0
+        self._undo = deque()
+        self._redo = deque()
+        self._pending = None
+
+    def begin(self):
+        if self._pending is None:
+            self._pending = []
+
+    def push(self, action, item, page_idx, layer):
+        if self._pending is None:
+            self._pending = [(action, item, page_idx, layer)]
+            self.commit()
+        else:
+            self._pending.append((action, item, page_idx, layer))
+
+    def commit(self):
+        ops, self._pending = self._pending, None
+        if not ops:
+            return
+        while self._redo:
+            self.memory_used -= self._redo.pop()[1]
+        cost = sum(_item_cost(op[1]) for op in ops)
+        self._undo.append((ops, cost))
+        self.memory_used += cost
+        while self.memory_used > self.memory_limit and len(self._undo) > 1:
+            self.memory_used -= self._undo.popleft()[1]
+
+    def undo(self):
+        self.commit()
+        if not self._undo:
+            return None
+        entry = self._undo.pop()
+        self._redo.append(entry)
+        return entry[0]
+
+    def redo(self):
+        self.commit()
+        if not self._redo:
+            return None
+        entry = self._redo.pop()
+        self._undo.append(entry)
+        return entry[0]
+
+    def clear(self):
+        self._undo.clear()
+        self._redo.clear()
+        self._pending = None
+        self.memory_used = 0
+
+def _percentiles(values):
+    if not values:
+        return {}
+    values = sorted(values)
+    pick = lambda q: values[min(len(values) - 1, int(q * len(values)))] * 1000
+    return {"p50": pick(0.50), "p90": pick(0.90), "p95": pick(0.95), "p99": pick(0.99),
+            "max": values[-1] * 1000, "mean": sum(values) / len(values) * 1000}
+
+class TraceEvent:
+    # Stand-in for a mouse/tablet event rebuilt from a recorded trace
+    def __init__(self, x, y, pressure=1.0):
+        self._pos = QtCore.QPointF(x, y)
+        self._pressure = pressure
+
+    def pos(self):
+        return self._pos.toPoint()
+
+    def posF(self):
+        return self._pos
+
+    def pressure(self):
+        return self._pressure
+
+    def button(self):
+        return QtCore.Qt.LeftButton
+
+class StartupTimer:
+    # Checkpoints from module import to the first rendered page, printed with --startup-timing
+    def __init__(self, exit_after=False):
+        self.marks = [("start", _MODULE_START)]
+        self.exit_after = exit_after  # quit once the report is printed
+
+    def mark(self, name):
+        self.marks.append((name, time.perf_counter()))
+
+    def report(self, out=sys.stderr):
+        start = prev = self.marks[0][1]
+        for name, at in self.marks[1:]:
+            print(f"{name:<28}{(at - prev) * 1000:9.1f} ms{(at - start) * 1000:10.1f} ms", file=out)
+            prev = at
+
+class InputRecorder:
+    # Logs timestamped input passing through AnnotatorView as [t, kind, ...] rows
+    def __init__(self, annotator):
+        self.annotator = annotator
+        self.active = False
+        self.events = []
+        self._t0 = 0.0
+
+    def start(self):
+        a = self.annotator
+        self.events = []
+        self.state = {
+            "pdf": os.path.basename(a.pdf_path) if a.pdf_path else None,
+            "tool": a.current_tool,
+            "color": a.pen_color.name(),
+            "width": a.pen_width,
+            "scale": a.scale,
+            "scroll": [a.view.horizontalScrollBar().value(), a.view.verticalScrollBar().value()],
+        }
+        self._t0 = time.perf_counter()
+        self.active = True
+
+    def record(self, kind, ev, device="mouse"):
+        pos = ev.posF() if hasattr(ev, "posF") else QtCore.QPointF(ev.pos())
+        pressure = ev.pressure() if device == "tablet" else 1.0
+        self.events.append([round(time.perf_counter() - self._t0, 6), kind, pos.x(), pos.y(), pressure, device])
+
+    def record_view(self, kind, *values):
+        self.events.append([round(time.perf_counter() - self._t0, 6), kind, *values])
+
+    def stop(self):
+        self.active = False
+        return dict(self.state, version=1, events=self.events)
+
+class InputReplayer(QtCore.QObject):
+    # Feeds a recorded trace back into the annotator tools and measures latency.
+    # speed > 1 replays faster than recorded, speed 0 replays as fast as possible.
+    finished = QtCore.pyqtSignal(dict)
+
+    def __init__(self, annotator, trace, speed=1.0, parent=None):
+        super().__init__(parent)
+        self.annotator = annotator
+        self.trace = trace
+        self.speed = speed
+        self.processing = []
+        self.paint_latency = []
+        self._pending = []
+        self._index = 0
+
+    def start(self):
+        a, trace = self.annotator, self.trace
+        a._select_tool(trace.get("tool", a.current_tool))
+        a.pen_color = QtGui.QColor(trace.get("color", a.pen_color.name()))
+        a._update_swatch()
+        a.width_slider.setValue(trace.get("width", a.pen_width))
+        if trace.get("scale"):
+            a._zoom(trace["scale"] / a.scale)
+        h, v = trace.get("scroll", [0, 0])
+        a.view.horizontalScrollBar().setValue(h)
+        a.view.verticalScrollBar().setValue(v)
+        a.view.painted.connect(self._on_painted)
+        self._t0 = time.perf_counter()
+        self._schedule()
+
+    def _schedule(self):
+        events = self.trace["events"]
+        if self._index >= len(events):
+            # Leave time for the last stroke segment to reach the screen
+            QtCore.QTimer.singleShot(100, self._finish)
+            return
+        delay = 0
+        if self.speed:
+            due = events[self._index][0] / self.speed
+            delay = max(0, int((due - (time.perf_counter() - self._t0)) * 1000))
+        QtCore.QTimer.singleShot(delay, self._step)
+
+    def _step(self):
+        row = self.trace["events"][self._index]
+        self._index += 1
+        a, kind = self.annotator, row[1]
+        start = time.perf_counter()
+        if kind == "press":
+            a.view._flush_tablet()
+            a._start_tool(TraceEvent(row[2], row[3], row[4]))
+        elif kind == "move":
+            if a.drawing and row[5] == "tablet":
+                a.view._queue_tablet_sample(QtCore.QPointF(row[2], row[3]), row[4])
+            elif a.drawing:
+                a._move_tool(TraceEvent(row[2], row[3], row[4]))
+        elif kind == "release":
+            a.view._flush_tablet()
+            a._end_tool(TraceEvent(row[2], row[3], row[4]))
+        elif kind == "scroll":
+            a.view.horizontalScrollBar().setValue(row[2])
+            a.view.verticalScrollBar().setValue(row[3])
+        elif kind == "zoom":
+            a._zoom(row[2])
+        end = time.perf_counter()
+        self.processing.append(end - start)
+        self._pending.append(start)
+        self._schedule()
+
+    def _on_painted(self):
+        now = time.perf_counter()
+        self.paint_latency.extend(now - t for t in self._pending)
+        self._pending = []
+
+    def _finish(self):
+        self.annotator.view.painted.disconnect(self._on_painted)
+        self.finished.emit({
+            "events": len(self.trace["events"]),
+            "speed": self.speed,
+            "wall_time": time.perf_counter() - self._t0,
+            "processing_ms": _percentiles(self.processing),
+            "paint_latency_ms": _percentiles(self.paint_latency),
+            "unpainted_events": len(self._pending),
+        })
+
+class PageItem(QtWidgets.QGraphicsPixmapItem):
+    # Page sized from the PDF before it is rendered; RenderScheduler fills in and evicts the pixmap
+    def __init__(self, page_idx, width, height):
+        super().__init__()
+        self.page_idx = page_idx
+        self.page_rect = QtCore.QRectF(0, 0, width, height)
+        self.failed = False
+        self.detail = 1.0  # resolution of the current pixmap, as a multiple of the base zoom
+        self.setZValue(-1)
+
+    def boundingRect(self):
+        return self.page_rect
+
+    def shape(self):
+        path = QtGui.QPainterPath()
+        path.addRect(self.page_rect)
+        return path
+
+    def paint(self, painter, option, widget=None):
+        pix = self.pixmap()
+        if pix.isNull():
+            painter.fillRect(self.page_rect, QtGui.QColor("#2a2a3a"))
+        else:
+            painter.drawPixmap(self.page_rect, pix, QtCore.QRectF(pix.rect()))
+
+class RenderScheduler(QtCore.QObject):
+    # One render queue for all open documents. Only the active tab renders, visible pages
+    # first, one page per event-loop turn; pixmaps of every tab share one memory budget and
+    # background tabs are evicted before the active one.
+    page_rendered = QtCore.pyqtSignal(object, int)
+    page_evicted = QtCore.pyqtSignal(object, int)
+
+    def __init__(self, render, budget=PIXMAP_MEMORY_BUDGET, parent=None):
+        super().__init__(parent)
+        self.render = render
+        self.budget = budget
+        self.active = None
+        self.resident = OrderedDict()  # (tab, page_idx) -> bytes, least recently used first
+        self.memory_used = 0
+        self._timer = QtCore.QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.setInterval(0)
+        self._timer.timeout.connect(self._render_next)
+
+    def set_active(self, tab):
+        self.active = tab
+        self.schedule()
+
+    def schedule(self):
+        if not self._timer.isActive():
+            self._timer.start()
+
+    def is_idle(self):
+        return not self._timer.isActive()
+
+    def _visible(self, tab):
+        view = tab.view
+        rect = view.mapToScene(view.viewport().rect()).boundingRect()
+        first = max(0, bisect.bisect_right(tab.page_tops, rect.top()) - 1)
+        last = bisect.bisect_right(tab.page_tops, rect.bottom())
+        return first, last
+
+    def _detail(self, tab):
+        # Stepped, so wheel zooming re-renders a page a few times rather than on every notch
+        scale = tab.view.transform().m11()
+        return next((level for level in DETAIL_LEVELS if scale <= level), DETAIL_LEVELS[-1])
+
+    def _wanted(self, tab):
+        first, last = self._visible(tab)
+        visible = list(range(first, last))
+        ahead = list(range(last, min(len(tab.page_items), last + PREFETCH_PAGES)))
+        behind = list(range(first - 1, max(0, first - PREFETCH_PAGES) - 1, -1))
+        return visible + ahead + behind
+
+    def _render_next(self):
+        tab = self.active
+        if tab is None or tab.doc is None:
+            return
+        wanted = self._wanted(tab)
+        first, last = self._visible(tab)
+        detail = self._detail(tab)
+        for idx in wanted:
+            item = tab.page_items[idx]
+            if item.failed:
+                continue
+            wanted_detail = detail if first <= idx < last else 1.0
+            old = item.pixmap()
+            if not old.isNull() and item.detail >= wanted_detail:
+                self.resident.move_to_end((tab, idx))
+                continue
+            try:
+                pix = QtGui.QPixmap.fromImage(self.render(idx, wanted_detail))
+            except Exception as e:
+                print(f"Failed to render page {idx}: {str(e)}")
+                item.failed = True
+                self.schedule()
+                return
+            item.setPixmap(pix)
+            item.detail = wanted_detail
+            size = pix.width() * pix.height() * pix.depth() // 8
+            if not old.isNull():
+                # A sharper copy of a resident page; its thumbnail stays, its overlay is flattened again to match
+                size -= old.width() * old.height() * old.depth() // 8
+                self.resident[(tab, idx)] += size
+                self.resident.move_to_end((tab, idx))
+                self.memory_used += size
+                self.page_rendered.emit(tab, idx)
+                self._evict(set(wanted))
+                self.schedule()
+                return
+            self.resident[(tab, idx)] = size
+            self.memory_used += size
+            self.page_rendered.emit(tab, idx)
+            if idx not in tab.thumbnailed:
+                thumb = pix.scaled(100, 140, QtCore.Qt.KeepAspectRatio, QtCore.Qt.SmoothTransformation)
+                tab.thumbnail_list.item(idx).setIcon(QtGui.QIcon(thumb))
+                tab.thumbnailed.add(idx)
+            self._evict(set(wanted))
+            self.schedule()
+            return
+
+    def _evict(self, keep):
+        for background in (True, False):
+            for key in list(self.resident):
+                if self.memory_used <= self.budget:
+                    return
+                tab, idx = key
+                if background == (tab is self.active) or (tab is self.active and idx in keep):
+                    continue
+                self.memory_used -= self.resident.pop(key)
+                if idx < len(tab.page_items):
+                    tab.page_items[idx].setPixmap(QtGui.QPixmap())
+                self.page_evicted.emit(tab, idx)
+
+    def add_cost(self, tab, page_idx, size):
+        # Extra memory held on behalf of a resident page, e.g. its annotation overlay
+        key = (tab, page_idx)
+        if key in self.resident:
+            self.resident[key] += size
+            self.memory_used += size
+
+    def release(self, tab):
+        for key in [key for key in self.resident if key[0] is tab]:
+            self.memory_used -= self.resident.pop(key)
+
+    def forget(self, tab, page_idx):
+        self.memory_used -= self.resident.pop((tab, page_idx), 0)
+
+    def remap(self, tab, mapping):
+        # Pages of tab were renumbered old -> new; pages missing from mapping are gone
+        resident = OrderedDict()
+        for key, size in self.resident.items():
+            if key[0] is not tab:
+                resident[key] = size
+            elif key[1] in mapping:
+                resident[(tab, mapping[key[1]])] = size
+            else:
+                self.memory_used -= size
+        self.resident = resident
+
+class Layer:
+    # A named annotation group backed by one scene item. Annotations are children of
+    # `root`, so hiding, fading or locking a layer is one call however many items it has.
+    def __init__(self, name, scene):
+        self.name = name
+        self.items = {}  # item -> page_idx
+        self.locked = False
+        self.root = QtWidgets.QGraphicsRectItem()
+        self.root.setFlag(QtWidgets.QGraphicsItem.ItemHasNoContents)
+        scene.addItem(self.root)
+
+    @property
+    def visible(self):
+        return self.root.isVisible()
+
+    def add(self, item, page_idx):
+        self.items[item] = page_idx
+        item.setParentItem(self.root)
+
+    def discard(self, item):
+        self.items.pop(item, None)
+        if item.scene():
+            item.scene().removeItem(item)
+
+    def set_locked(self, locked):
+        self.locked = locked
+        self.root.setEnabled(not locked)
+
+    def state(self):
+        return {'name': self.name, 'visible': self.visible, 'locked': self.locked, 'opacity': self.root.opacity()}
+
+    def apply_state(self, state):
+        self.root.setVisible(state.get('visible', True))
+        self.root.setOpacity(state.get('opacity', 1.0))
+        self.set_locked(state.get('locked', False))
+
+class DocumentTab:
+    # Everything that belongs to one open document. PDFAnnotator exposes the active
+    # tab's fields as its own attributes, so tools always act on the tab in front.
+    def __init__(self, window):
+        self.pdf_path = None
+        self.doc = None
+        self.cache_key = None
+        self.scene = QGraphicsScene()
+        self.view = AnnotatorView(self.scene, window)
+        self.view.tab = self
+        self.thumbnail_list = ThumbnailWidget()
+        self.page_items = []
+        self.page_tops = []
+        self.thumbnailed = set()
+        self.layers = {"Default": Layer("Default", self.scene)}  # bottom to top
+        self.current_layer = "Default"
+        self.page_annotations = {}  # page_idx -> {item: layer}
+        self.overlays = {}  # page_idx -> {layer name: flattened annotation pixmap item}
+        self.dirty_overlays = set()
+        self.active_page = None
+        self.importer = None
+        self.import_queue = deque()
+        self.native_items = set()  # items still arriving from an unfinished native import
+        self.native_keys = set()  # PDF annotations replaced by imported items; see _native_key
+        self.import_keys = set()  # keys of the running import, added to native_keys once it finishes
+        self.page_ops = []  # page-structure edits applied to doc but not yet written to pdf_path
+        self.page_saver = None
+        self.selection = None  # [page_idx, anchor char, focus char]
+        self.selection_item = None
+        self.records = {}  # item -> sidecar record from the last snapshot
+        self.dirty_items = set()
+        self.revision = 0  # bumped by every annotation or layer change
+        self.saved_revision = 0
+        self.saving = False
+        self.save_pending = False
+        self.save_worker = None
+        self.differ = None
+        self.diff_items = {}  # page_idx -> changed-region overlay, a child of the page item
+        self.diff_ranking = []  # [page_idx, changed fraction], most changed first
+        self.outline_model = None  # built the first time the outline is shown for this document
+        self.undo_stack = UndoStack(window.undo_memory_limit)
+        self.scale = 1.0
+        self.grid_on = False
+        self.grid_item = None
+
+def _flattenable(item):
+    # Finished shapes are baked into the page overlay; text and comment markers stay interactive
+    if isinstance(item, QGraphicsEllipseItem):
+        return not item.toolTip()
+    return isinstance(item, (QGraphicsPathItem, QGraphicsLineItem, QGraphicsRectItem))
+
+def _tab_attr(name):
+    return property(lambda self: getattr(self.tab, name), lambda self, value: setattr(self.tab, name, value))
+
 class ThumbnailWidget(QListWidget):
     def __init__(self, parent=None):
         super().__init__(parent)
@@ -113,31 +1551,151 @@ class ThumbnailWidget(QListWidget):
             }
         """)
 
+class OutlineNode:
+    __slots__ = ("entry", "title", "parent", "row", "children", "cursor")
+
+    def __init__(self, entry, parent, row):
+        self.entry = entry  # fitz.Outline, None for the root
+        self.title = entry.title if entry is not None else ""
+        self.parent = parent
+        self.row = row
+        self.children = []
+        self.cursor = entry.down if entry is not None else None  # first child not read yet
+
+class OutlineModel(QtCore.QAbstractItemModel):
+    # Walks the document outline one level at a time. A node's children are read from
+    # MuPDF only when it is expanded, in batches as the list scrolls, so outlines with
+    # tens of thousands of entries open instantly and unexpanded branches cost nothing.
+    def __init__(self, doc):
+        super().__init__()
+        if not doc.is_encrypted:
+            doc.init_doc()  # MuPDF keeps the outline read at open, with page numbers from before any page edits
+        self.root = OutlineNode(None, None, 0)
+        self.root.cursor = doc.outline
+
+    def _node(self, index):
+        return index.internalPointer() if index.isValid() else self.root
+
+    def entry(self, index):
+        return index.internalPointer().entry if index.isValid() else None
+
+    def index(self, row, column, parent=QtCore.QModelIndex()):
+        node = self._node(parent)
+        if column or not 0 <= row < len(node.children):
+            return QtCore.QModelIndex()
+        return self.createIndex(row, 0, node.children[row])
+
+    def parent(self, index):
+        node = self._node(index)
+        if node.parent is None or node.parent is self.root:
+            return QtCore.QModelIndex()
+        return self.createIndex(node.parent.row, 0, node.parent)
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.column() > 0 else len(self._node(parent).children)
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        return 1
+
+    def hasChildren(self, parent=QtCore.QModelIndex()):
+        node = self._node(parent)
+        return bool(node.children) or node.cursor is not None
+
+    def canFetchMore(self, parent):
+        return self._node(parent).cursor is not None
+
+    def fetchMore(self, parent):
+        node = self._node(parent)
+        batch = []
+        entry = node.cursor
+        while entry is not None and len(batch) < OUTLINE_BATCH:
+            batch.append(entry)
+            entry = entry.next
+        node.cursor = entry
+        if not batch:
+            return
+        first = len(node.children)
+        self.beginInsertRows(parent, first, first + len(batch) - 1)
+        node.children.extend(OutlineNode(e, node, first + i) for i, e in enumerate(batch))
+        self.endInsertRows()
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        node = index.internalPointer()
+        if role == QtCore.Qt.DisplayRole:
+            return node.title
+        if role == QtCore.Qt.ToolTipRole:
+            if node.entry.is_external:
+                return node.entry.uri
+            return f"Page {node.entry.page + 1}" if node.entry.page >= 0 else None
+        return None
+
 class AnnotatorView(QGraphicsView):
+    painted = QtCore.pyqtSignal()
+
     def __init__(self, scene, parent):
         super().__init__(scene, parent)
         self.parent = parent
-        self.setViewport(QOpenGLWidget())
+        self.recorder = None
+        self._pressed_item = None
+        self._tablet_samples = []
+        self._tablet_timer = QtCore.QTimer(self)
+        self._tablet_timer.setSingleShot(True)
+        self._tablet_timer.setInterval(TABLET_FRAME_MS)
+        self._tablet_timer.timeout.connect(self._flush_tablet)
         self.setRenderHints(QtGui.QPainter.Antialiasing | QtGui.QPainter.SmoothPixmapTransform)
         self.setAlignment(QtCore.Qt.AlignTop | QtCore.Qt.AlignLeft)
         self.setViewportUpdateMode(QGraphicsView.FullViewportUpdate)
         self.setDragMode(QGraphicsView.NoDrag)
         self.setTransformationAnchor(QGraphicsView.AnchorUnderMouse)
 
+    def use_gl(self):
+        # Creating a GL context is slow, so views start on the raster viewport and switch after startup
+        if not isinstance(self.viewport(), QOpenGLWidget):
+            self.setViewport(QOpenGLWidget())
+
+    def paintEvent(self, ev):
+        super().paintEvent(ev)
+        self.painted.emit()
+
+    def resizeEvent(self, ev):
+        super().resizeEvent(ev)
+        self.parent.render_scheduler.schedule()
+
     def tabletEvent(self, event):
+        if self.recorder and self.recorder.active:
+            kind = {QtCore.QEvent.TabletPress: "press", QtCore.QEvent.TabletMove: "move",
+                    QtCore.QEvent.TabletRelease: "release"}.get(event.type())
+            if kind:
+                self.recorder.record(kind, event, "tablet")
         if event.type() == QtCore.QEvent.TabletPress:
-            print(f"Tablet Press: Pressure={event.pressure()}, Pos={event.pos()}")
+            self._flush_tablet()
             self.parent._start_tool(event)
         elif event.type() == QtCore.QEvent.TabletMove:
             if self.parent.drawing:
-                print(f"Tablet Move: Pressure={event.pressure()}, Pos={event.pos()}")
-                self.parent._move_tool(event)
+                self._queue_tablet_sample(event.posF(), event.pressure())
         elif event.type() == QtCore.QEvent.TabletRelease:
-            print(f"Tablet Release: Pos={event.pos()}")
+            self._flush_tablet()
             self.parent._end_tool(event)
         event.accept()
 
+    def _queue_tablet_sample(self, pos, pressure):
+        # Pens report several hundred moves a second; keep them and apply them together once per frame
+        self._tablet_samples.append((pos, pressure))
+        if not self._tablet_timer.isActive():
+            self._tablet_timer.start()
+
+    def _flush_tablet(self):
+        self._tablet_timer.stop()
+        samples, self._tablet_samples = self._tablet_samples, []
+        if samples and self.parent.drawing:
+            self.parent._move_tool_samples(samples)
+
     def mousePressEvent(self, ev):
+        if self.recorder and self.recorder.active and ev.button() == QtCore.Qt.LeftButton:
+            self.recorder.record("press", ev)
+        self._pressed_item = self.itemAt(ev.pos())
         if self.parent.current_tool == "pan":
             self.setDragMode(QGraphicsView.ScrollHandDrag)
             super().mousePressEvent(ev)
@@ -146,6 +1704,8 @@ class AnnotatorView(QGraphicsView):
         return super().mousePressEvent(ev)
 
     def mouseMoveEvent(self, ev):
+        if self.recorder and self.recorder.active and self.parent.drawing:
+            self.recorder.record("move", ev)
         if self.parent.drawing:
             self.parent._move_tool(ev)
         elif self.parent.current_tool == "pan":
@@ -153,11 +1713,29 @@ class AnnotatorView(QGraphicsView):
         return super().mouseMoveEvent(ev)
 
     def mouseReleaseEvent(self, ev):
+        if self.recorder and self.recorder.active and ev.button() == QtCore.Qt.LeftButton:
+            self.recorder.record("release", ev)
         if self.parent.current_tool == "pan":
             self.setDragMode(QGraphicsView.NoDrag)
         elif ev.button() == QtCore.Qt.LeftButton:
             self.parent._end_tool(ev)
-        return super().mouseReleaseEvent(ev)
+        result = super().mouseReleaseEvent(ev)
+        if self._pressed_item is not None:
+            self.parent._item_released(self._pressed_item)
+            self._pressed_item = None
+        return result
+
+    def scene_point(self, pos):
+        # mapToScene only takes whole pixels in Qt 5, which would snap pen samples to the pixel grid
+        return self.viewportTransform().inverted()[0].map(QtCore.QPointF(pos))
+
+    def jump_to(self, pos):
+        # Brings scene point pos to the top of the viewport, scrolling sideways only if it is out of view
+        visible = self.mapToScene(self.viewport().rect()).boundingRect()
+        x = visible.center().x()
+        if not visible.left() <= pos.x() <= visible.right():
+            x = pos.x() + visible.width() / 2
+        self.centerOn(x, pos.y() + visible.height() / 2)
 
     def wheelEvent(self, ev):
         if ev.modifiers() & QtCore.Qt.ControlModifier:
@@ -167,54 +1745,133 @@ class AnnotatorView(QGraphicsView):
             super().wheelEvent(ev)
 
 class PDFAnnotator(QMainWindow):
-    def __init__(self):
+    pdf_path = _tab_attr("pdf_path")
+    doc = _tab_attr("doc")
+    cache_key = _tab_attr("cache_key")
+    scene = _tab_attr("scene")
+    view = _tab_attr("view")
+    thumbnail_list = _tab_attr("thumbnail_list")
+    page_items = _tab_attr("page_items")
+    page_tops = _tab_attr("page_tops")
+    layers = _tab_attr("layers")
+    current_layer = _tab_attr("current_layer")
+    undo_stack = _tab_attr("undo_stack")
+    scale = _tab_attr("scale")
+    grid_on = _tab_attr("grid_on")
+    grid_item = _tab_attr("grid_item")
+
+    def __init__(self, startup=None):
         super().__init__()
+        self.startup = startup
         self.setWindowTitle("OpenPDF By Team Emogi")
         self.resize(1400, 900)
 
         # State
-        self.pdf_path = None
-        self.doc = None
-        self.page_items = []
-        self.layers = {"Default": []}
-        self.current_layer = "Default"
-        self.scene = QGraphicsScene()
-        self.view = AnnotatorView(self.scene, self)
-        self.render_zoom = 2.0  # Higher quality rendering (144 DPI)
+        self.tab = None
+        self.render_zoom = RENDER_ZOOM  # Higher quality rendering (144 DPI)
+        self.color_mode = "dark"
         
         # UI Setup
         self.central_widget = QWidget()
         self.layout = QVBoxLayout(self.central_widget)
         self.setCentralWidget(self.central_widget)
-        self.layout.addWidget(self.view)
+        self.tab_widget = QtWidgets.QTabWidget()
+        self.tab_widget.setDocumentMode(True)
+        self.tab_widget.setTabsClosable(True)
+        self.tab_widget.setMovable(True)
+        self.tab_widget.currentChanged.connect(self._tab_changed)
+        self.tab_widget.tabCloseRequested.connect(self.close_tab)
+        self.layout.addWidget(self.tab_widget)
         
-        self.scale = 1.0
         self.current_tool = "pen"
         self.pen_color = QtGui.QColor(255, 255, 0)
         self.pen_width = 4
         self.drawing = False
         self.current_item = None
-        self.history = []
-        self.redo_stack = []
-        self.grid_on = False
-        self.grid_item = None
         self.is_fullscreen = False
         self.shortcuts = []
+        self._last_edit = 0.0
+        self._gl_viewports = False
+        self.layer_list = None
+        self.layer_opacity = None
+        self.changes_dock = None
+        self.outline_dock = None
+        self._save_worker = None
+        self._image_export_worker = None
+        self._closed_tabs = []  # closed tabs whose saves were still running; closeEvent waits for them
 
         # Settings for recent files
         self.settings = QtCore.QSettings("MyCompany", "PDFAnnotator")
+        self.undo_memory_limit = self.settings.value("undo_memory_limit", UNDO_MEMORY_LIMIT, type=int)
+        cache_dir = QtCore.QStandardPaths.writableLocation(QtCore.QStandardPaths.GenericCacheLocation)
+        self.page_cache = PageCache(
+            self.settings.value("page_cache_dir", os.path.join(cache_dir, "OpenPDF", "pages")),
+            self.settings.value("page_cache_limit", PAGE_CACHE_LIMIT, type=int),
+            lambda err: self.status.showMessage(f"Failed to write page cache: {err}", 5000))
+        self.render_scheduler = RenderScheduler(
+            self._render_page_image, self.settings.value("pixmap_memory_budget", PIXMAP_MEMORY_BUDGET, type=int), self)
+        self.render_scheduler.page_rendered.connect(self._page_rendered)
+        self.render_scheduler.page_evicted.connect(self._unflatten_page)
+        self.text_cache = TextCache()
+        self.display_lists = DisplayListCache(self.settings.value("display_list_budget", DISPLAY_LIST_BUDGET, type=int))
+        self.flatten_timer = QtCore.QTimer(self)
+        self.flatten_timer.setSingleShot(True)
+        self.flatten_timer.setInterval(FLATTEN_IDLE_MS)
+        self.flatten_timer.timeout.connect(self._flatten_active_page)
+        self.overlay_timer = QtCore.QTimer(self)
+        self.overlay_timer.setSingleShot(True)
+        self.overlay_timer.setInterval(0)
+        self.overlay_timer.timeout.connect(self._refresh_overlays)
+        self.import_timer = QtCore.QTimer(self)
+        self.import_timer.setSingleShot(True)
+        self.import_timer.setInterval(0)
+        self.import_timer.timeout.connect(self._attach_imported)
 
         # Initialize UI components
         self._apply_modern_theme()
         self._build_toolbar()
         self._build_menu()
         self._setup_dock_widgets()
-        self._register_shortcuts()
         self._setup_autosave()
         
         self.status = QStatusBar()
         self.setStatusBar(self.status)
+        self._new_tab()
         self._update_status()
+        if self.startup:
+            self.startup.mark("window built")
+
+    def finish_startup(self, paths=()):
+        # Runs once the window is on screen: documents first, so the first page is not kept
+        # waiting, then the widgets that are not needed to show it
+        if self.startup:
+            self.startup.mark("window shown")
+        _load_pymupdf()  # here on the GUI thread, not in a worker
+        if self.startup:
+            self.startup.mark("PyMuPDF loaded")
+        for path in paths:
+            self._load_pdf(os.path.abspath(path))
+        if self.startup:
+            self.startup.mark("documents opened")
+            if not self.doc:
+                self._startup_done()
+        QtCore.QTimer.singleShot(0, self._build_deferred_widgets)
+
+    def _build_deferred_widgets(self):
+        # The stylesheet, toolbar, menus and docks stay in __init__: they are part of the first
+        # frame, and adding them later would restyle and re-lay out the window in front of the user
+        self._register_shortcuts()
+        self._build_layer_panel()
+        self._refresh_layer_list()
+        self._gl_viewports = True
+        for tab in self._tabs():
+            tab.view.use_gl()
+
+    def _startup_done(self):
+        startup, self.startup = self.startup, None
+        startup.report()
+        if startup.exit_after:
+            QApplication.quit()
 
     def _apply_modern_theme(self):
         self.setStyleSheet("""
@@ -302,6 +1959,18 @@ class PDFAnnotator(QMainWindow):
                 border: none;
                 width: 24px;
             }
+            QTabBar::tab {
+                background: #252535;
+                color: #e0e0e0;
+                padding: 6px 14px;
+                border: 1px solid #353545;
+                font-family: 'Segoe UI', sans-serif;
+                font-size: 12px;
+            }
+            QTabBar::tab:selected {
+                background: #353545;
+                border-bottom: 2px solid #26a69a;
+            }
             QScrollBar:vertical {
                 background: #252535;
                 width: 14px;
@@ -386,6 +2055,7 @@ class PDFAnnotator(QMainWindow):
         add_btn("◯", "Ellipse", "ellipse")
         add_btn("🅰️", "Text", "text")
         add_btn("💬", "Comment", "comment")
+        add_btn("🔤", "Select", "select")
         add_btn("🧽", "Eraser", "eraser")
         add_btn("✋", "Pan", "pan")
         tb.addSeparator()
@@ -431,27 +2101,57 @@ class PDFAnnotator(QMainWindow):
 
     def _setup_dock_widgets(self):
         self.thumbnail_dock = QDockWidget("Pages", self)
-        self.thumbnail_list = ThumbnailWidget()
-        self.thumbnail_dock.setWidget(self.thumbnail_list)
+        self.thumbnail_stack = QtWidgets.QStackedWidget()
+        self.thumbnail_dock.setWidget(self.thumbnail_stack)
         self.addDockWidget(QtCore.Qt.LeftDockWidgetArea, self.thumbnail_dock)
-        self.thumbnail_list.itemClicked.connect(self._thumbnail_clicked)
 
+        # The layer panel's contents are built after startup; the empty dock holds its place
         self.layer_dock = QDockWidget("Layers", self)
+        self.addDockWidget(QtCore.Qt.RightDockWidgetArea, self.layer_dock)
+
+    def _build_layer_panel(self):
+        if self.layer_list is not None:
+            return
         layer_widget = QWidget()
         layer_layout = QVBoxLayout(layer_widget)
         
-        self.layer_combo = QComboBox()
-        self.layer_combo.addItem("Default")
-        self.layer_combo.currentTextChanged.connect(self._change_layer)
-        layer_layout.addWidget(self.layer_combo)
-        
-        add_layer_btn = QToolButton()
-        add_layer_btn.setText("Add Layer")
-        add_layer_btn.clicked.connect(self._add_layer)
-        layer_layout.addWidget(add_layer_btn)
+        self.layer_list = QListWidget()
+        self.layer_list.setStyleSheet("""
+            QListWidget {
+                background: #252535;
+                border: none;
+                color: #e0e0e0;
+                font-family: 'Segoe UI', sans-serif;
+            }
+            QListWidget::item:selected {
+                background: #26a69a;
+                color: #ffffff;
+            }
+        """)
+        self.layer_list.currentItemChanged.connect(lambda item, _: item and self._change_layer(item.data(QtCore.Qt.UserRole)))
+        self.layer_list.itemChanged.connect(self._layer_item_changed)
+        layer_layout.addWidget(self.layer_list)
+
+        button_row = QtWidgets.QHBoxLayout()
+        for text, tip, slot in (("＋", "Add Layer", self._add_layer), ("－", "Delete Layer", self._delete_layer),
+                                ("▲", "Move Layer Up", lambda: self._move_layer(1)),
+                                ("▼", "Move Layer Down", lambda: self._move_layer(-1)),
+                                ("🔒", "Lock/Unlock Layer", self._toggle_layer_lock)):
+            btn = QToolButton()
+            btn.setText(text)
+            btn.setToolTip(tip)
+            btn.clicked.connect(slot)
+            button_row.addWidget(btn)
+        layer_layout.addLayout(button_row)
+
+        self.layer_opacity = QSlider(QtCore.Qt.Horizontal)
+        self.layer_opacity.setRange(0, 100)
+        self.layer_opacity.setValue(100)
+        self.layer_opacity.setToolTip("Layer Opacity")
+        self.layer_opacity.valueChanged.connect(self._set_layer_opacity)
+        layer_layout.addWidget(self.layer_opacity)
         
         self.layer_dock.setWidget(layer_widget)
-        self.addDockWidget(QtCore.Qt.RightDockWidgetArea, self.layer_dock)
 
     def _build_menu(self):
         mb = self.menuBar()
@@ -466,14 +2166,43 @@ class PDFAnnotator(QMainWindow):
         self._update_recent_menu()
         mitem(file_menu, "Save Annotations", self.save_annotations)
         mitem(file_menu, "Export Annotated PDF...", self.export_pdf)
+        self.linearize_action = QAction("Linearize Exported PDFs (Fast Web View)", self)
+        self.linearize_action.setCheckable(True)
+        self.linearize_action.setChecked(self.settings.value("export_linearize", False, type=bool))
+        self.linearize_action.toggled.connect(lambda on: self.settings.setValue("export_linearize", on))
+        file_menu.addAction(self.linearize_action)
+        mitem(file_menu, "Export Pages as Images...", self.export_images)
+        mitem(file_menu, "Close Tab", lambda: self.close_tab(self.tab_widget.currentIndex()))
         file_menu.addSeparator()
         mitem(file_menu, "Exit", self.close)
 
         edit_menu = mb.addMenu("&Edit")
         mitem(edit_menu, "Undo", self.undo)
         mitem(edit_menu, "Redo", self.redo)
+        mitem(edit_menu, "Copy Text", self.copy_selection)
+        mitem(edit_menu, "Highlight Selected Text", self.highlight_selection)
         mitem(edit_menu, "Clear All", self.clear_all)
 
+        tools_menu = mb.addMenu("&Tools")
+        self.record_action = QAction("Record Input Trace", self)
+        self.record_action.setCheckable(True)
+        self.record_action.toggled.connect(self._toggle_recording)
+        tools_menu.addAction(self.record_action)
+        mitem(tools_menu, "Replay Input Trace...", self.replay_trace)
+        tools_menu.addSeparator()
+        mitem(tools_menu, "Compare With PDF...", self.compare_pdf)
+        mitem(tools_menu, "Clear Comparison", lambda: self._clear_diff(self.tab))
+
+        pages_menu = mb.addMenu("&Pages")
+        mitem(pages_menu, "Move Page Up", lambda: self.move_page(-1))
+        mitem(pages_menu, "Move Page Down", lambda: self.move_page(1))
+        mitem(pages_menu, "Move Page To...", self.move_page_to)
+        mitem(pages_menu, "Insert Pages From PDF...", self.insert_pages)
+        mitem(pages_menu, "Delete Page", self.delete_page)
+        pages_menu.addSeparator()
+        mitem(pages_menu, "Rotate Clockwise", lambda: self.rotate_page(90))
+        mitem(pages_menu, "Rotate Counterclockwise", lambda: self.rotate_page(-90))
+
         view_menu = mb.addMenu("&View")
         mitem(view_menu, "Zoom In", lambda: self._zoom(1.15))
         mitem(view_menu, "Zoom Out", lambda: self._zoom(1/1.15))
@@ -483,6 +2212,7 @@ class PDFAnnotator(QMainWindow):
         mitem(view_menu, "Toggle Grid", self.toggle_grid)
         mitem(view_menu, "Toggle Thumbnails", lambda: self.thumbnail_dock.setVisible(not self.thumbnail_dock.isVisible()))
         mitem(view_menu, "Toggle Layers", lambda: self.layer_dock.setVisible(not self.layer_dock.isVisible()))
+        mitem(view_menu, "Toggle Outline", self.toggle_outline)
 
         help_menu = mb.addMenu("&Help")
         mitem(help_menu, "About", self.show_about)
@@ -513,9 +2243,13 @@ class PDFAnnotator(QMainWindow):
 
         shortcuts = [
             ("Ctrl+O", self.open_pdf),
+            ("Ctrl+F4", lambda: self.close_tab(self.tab_widget.currentIndex())),
+            ("Ctrl+Tab", lambda: self.tab_widget.setCurrentIndex((self.tab_widget.currentIndex() + 1) % self.tab_widget.count())),
             ("Ctrl+S", self.save_annotations),
             ("Ctrl+Z", self.undo),
             ("Ctrl+Y", self.redo),
+            ("Ctrl+C", self.copy_selection),
+            ("Ctrl+Shift+H", self.highlight_selection),
             ("Ctrl++", lambda: self._zoom(1.15)),
             ("Ctrl+-", lambda: self._zoom(1/1.15)),
             ("Ctrl+W", self.fit_width),
@@ -523,6 +2257,7 @@ class PDFAnnotator(QMainWindow):
             ("Ctrl+G", self.toggle_grid),
             ("Ctrl+T", lambda: self.thumbnail_dock.setVisible(not self.thumbnail_dock.isVisible())),
             ("Ctrl+L", lambda: self.layer_dock.setVisible(not self.layer_dock.isVisible())),
+            ("Ctrl+B", self.toggle_outline),
             ("PageUp", self.page_up),
             ("PageDown", self.page_down),
             ("F11", self._toggle_fullscreen),
@@ -536,8 +2271,12 @@ class PDFAnnotator(QMainWindow):
 
     def _setup_autosave(self):
         self.autosave_timer = QtCore.QTimer(self)
-        self.autosave_timer.timeout.connect(self.save_annotations)
+        self.autosave_timer.timeout.connect(self._autosave)
         self.autosave_timer.start(AUTOSAVE_INTERVAL)
+        self.autosave_retry = QtCore.QTimer(self)
+        self.autosave_retry.setSingleShot(True)
+        self.autosave_retry.setInterval(AUTOSAVE_IDLE_MS)
+        self.autosave_retry.timeout.connect(self._autosave)
 
     def open_pdf(self):
         path, _ = QFileDialog.getOpenFileName(self, "Open PDF", "", "PDF Files (*.pdf)")
@@ -545,67 +2284,152 @@ class PDFAnnotator(QMainWindow):
             return
         self._load_pdf(path)
 
+    def _new_tab(self):
+        tab = DocumentTab(self)
+        tab.thumbnail_list.itemClicked.connect(self._thumbnail_clicked)
+        tab.view.horizontalScrollBar().valueChanged.connect(self.render_scheduler.schedule)
+        tab.view.verticalScrollBar().valueChanged.connect(self.render_scheduler.schedule)
+        if self._gl_viewports:
+            tab.view.use_gl()
+        self.thumbnail_stack.addWidget(tab.thumbnail_list)
+        self.tab_widget.addTab(tab.view, "Untitled")
+        self.tab_widget.setCurrentWidget(tab.view)
+        return tab
+
+    def _tabs(self):
+        return [self.tab_widget.widget(i).tab for i in range(self.tab_widget.count())]
+
+    def _tab_changed(self, index):
+        widget = self.tab_widget.widget(index)
+        if widget is None:
+            return
+        if isinstance(self.current_item, InkStrokeItem):
+            self.current_item.finish()
+        self.drawing = False
+        self.current_item = None
+        self.tab = widget.tab
+        self.thumbnail_stack.setCurrentWidget(self.thumbnail_list)
+        self._refresh_layer_list()
+        self.render_scheduler.set_active(self.tab)
+        if self.tab.import_queue:
+            self.import_timer.start()
+        self._refresh_changes_list()
+        self._refresh_outline()
+        self._update_status()
+
+    def close_tab(self, index):
+        widget = self.tab_widget.widget(index)
+        if widget is None:
+            return
+        tab = widget.tab
+        self._stop_import(tab)
+        self._stop_diff(tab)
+        self.text_cache.release(tab)
+        self.display_lists.release(tab)
+        self._reset_outline(tab)
+        if tab.doc:
+            self._save_before_close(tab)
+            tab.doc.close()
+            tab.doc = None
+            self._closed_tabs = [t for t in self._closed_tabs if t.page_saver or t.save_worker]
+            if tab.page_saver or tab.save_worker:
+                self._closed_tabs.append(tab)
+        self.render_scheduler.release(tab)
+        self.tab_widget.removeTab(index)
+        self.thumbnail_stack.removeWidget(tab.thumbnail_list)
+        tab.view.deleteLater()
+        tab.thumbnail_list.deleteLater()
+        if not self.tab_widget.count():
+            self._new_tab()
+
+    def _save_before_close(self, tab, buttons=QtWidgets.QMessageBox.Save | QtWidgets.QMessageBox.Discard):
+        # Returns False when the user cancels
+        self.tab_widget.setCurrentWidget(tab.view)
+        self._wait_for_saves(tab)
+        answer = QtWidgets.QMessageBox.Save
+        if tab.page_ops:
+            answer = QtWidgets.QMessageBox.question(
+                self, "Close", f"{os.path.basename(tab.pdf_path)} has unsaved page changes. Save them before closing? "
+                "Discarding also drops annotation changes made since the last save.",
+                buttons, QtWidgets.QMessageBox.Save)
+        if answer == QtWidgets.QMessageBox.Cancel:
+            return False
+        if answer == QtWidgets.QMessageBox.Save:
+            self.save_annotations(tab)
+        return True
+
+    def _finish_saving(self, tab):
+        # A page save hands over to the sidecar write from its saved signal, so deliver signals between waits
+        while tab.page_saver or tab.save_worker:
+            for worker in (tab.page_saver, tab.save_worker):
+                if worker:
+                    worker.wait()
+            QtWidgets.QApplication.processEvents()
+
     def _load_pdf(self, path):
-        self.pdf_path = path
+        tab = next((t for t in self._tabs() if t.pdf_path == path), None)
+        if tab is not None:
+            # Already open; reloading it in place would throw away its unsaved annotations
+            self.tab_widget.setCurrentWidget(tab.view)
+            return
         try:
-            self.doc = fitz.open(path)
+            doc = fitz.open(path)
         except Exception as e:
             QtWidgets.QMessageBox.critical(self, "Error", f"Failed to open PDF: {str(e)}")
             return
 
+        if self.doc is not None:
+            self._new_tab()
+        index = self.tab_widget.currentIndex()
+        self.tab_widget.setTabText(index, os.path.basename(path))
+        self.tab_widget.setTabToolTip(index, path)
+
+        self.render_scheduler.release(self.tab)
+        self.display_lists.release(self.tab)
+        self._reset_outline(self.tab)
+        self._reset_page_ops(self.tab)
+        if self.doc:
+            self.doc.close()
+        self.pdf_path = path
+        self.doc = doc
+        self.cache_key = self.page_cache.doc_key(path)
+
         self.scene.clear()
         self.page_items.clear()
+        self.page_tops.clear()
         self.thumbnail_list.clear()
-        self.layers = {"Default": []}
-        self.layer_combo.clear()
-        self.layer_combo.addItem("Default")
-
-        progress = QProgressDialog("Loading PDF pages...", "Cancel", 0, self.doc.page_count, self)
-        progress.setWindowModality(QtCore.Qt.NonModal)
-        progress.setMinimumDuration(0)
+        self.tab.thumbnailed = set()
+        self._reset_annotation_state()
+        self.current_layer = "Default"
+        self._refresh_layer_list()
 
+        # Pages are laid out from their PDF size; RenderScheduler rasterizes them as they scroll into view
+        m = fitz.Matrix(self.render_zoom, self.render_zoom)  # 144 DPI
         y = 0
         for i in range(self.doc.page_count):
-            if progress.wasCanceled():
-                self.doc.close()
-                self.doc = None
-                self._update_status()
-                return
-            
-            progress.setValue(i)
-            QApplication.processEvents()
-            
             try:
-                pg = self.doc.load_page(i)
-                m = fitz.Matrix(self.render_zoom, self.render_zoom)  # 144 DPI
-                pm = pg.get_pixmap(matrix=m, alpha=False)
-                img = QtGui.QImage(pm.samples, pm.width, pm.height, pm.stride, QtGui.QImage.Format_RGB888)
-                img.invertPixels()  # Dark mode
-                pix = QtGui.QPixmap.fromImage(img)
-                item = QtWidgets.QGraphicsPixmapItem(pix)
-                item.setPos(0, y)
-                self.scene.addItem(item)
-                self.page_items.append(item)
-                
-                thumb = pix.scaled(100, 140, QtCore.Qt.KeepAspectRatio, QtCore.Qt.SmoothTransformation)
-                thumb_item = QtWidgets.QListWidgetItem(QtGui.QIcon(thumb), f"Page {i+1}")
-                self.thumbnail_list.addItem(thumb_item)
-                
-                y += pix.height() + 20
-                del pm, img, pix, thumb
+                rect = (self.doc.load_page(i).rect * m).irect
             except Exception as e:
                 print(f"Failed to load page {i}: {str(e)}")
-                continue
+                rect = (fitz.paper_rect("a4") * m).irect
+            item = PageItem(i, rect.width, rect.height)
+            item.setPos(0, y)
+            self.scene.addItem(item)
+            self.page_items.append(item)
+            self.page_tops.append(y)
+            self.thumbnail_list.addItem(QtWidgets.QListWidgetItem(f"Page {i+1}"))
+            y += rect.height + 20
 
-        progress.setValue(self.doc.page_count)
-        
         self.view.setSceneRect(self.scene.itemsBoundingRect())
-        self.history.clear()
-        self.redo_stack.clear()
+        self.undo_stack.clear()
         self.view.verticalScrollBar().setValue(0)
+        self.render_scheduler.set_active(self.tab)
+        self._refresh_outline()
         self._update_status()
 
-        self._load_annotations()
+        adopt = self._load_annotations()
+        # Imports only annotations that are not in the sidecar yet, such as ones another tool added
+        self._import_native_annotations(adopt=adopt)
 
         recent_files = self.settings.value("recent_files", [])
         if self.pdf_path in recent_files:
@@ -616,15 +2440,144 @@ class PDFAnnotator(QMainWindow):
         self.settings.setValue("recent_files", recent_files)
         self._update_recent_menu()
 
-    def save_annotations(self):
-        if not self.doc:
+    def _render_page_image(self, page_idx, detail=1.0):
+        zoom = self.render_zoom * detail
+        # Only base-resolution renders go to the disk cache; sharper ones are redone from the display list
+        cached = self.cache_key and detail == 1.0
+        if cached:
+            img = self.page_cache.load(self.cache_key, page_idx, zoom, self.color_mode)
+            if img is not None:
+                return img
+        dlist = self.display_lists.get(self.tab, page_idx)
+        if dlist is None:
+            pg = self.doc.load_page(page_idx)
+            # Imported annotations are scene items; hide the originals in this in-memory copy only.
+            # While an import runs, everything it is about to bring in is hidden as well.
+            importing = self.tab.importer is not None or bool(self.tab.import_queue)
+            for xref, kind, _ in pg.annot_xrefs():
+                if kind not in NATIVE_ANNOT_TYPES:
+                    continue
+                if _native_key(self.doc, xref, kind) in self.tab.native_keys or \
+                        (importing and _native_converted(self.doc, pg, xref, kind)):
+                    flags = self.doc.xref_get_key(xref, "F")
+                    flags = int(flags[1]) if flags[0] == 'int' else 0
+                    self.doc.xref_set_key(xref, "F", str(flags | fitz.PDF_ANNOT_IS_HIDDEN))
+            dlist = self.display_lists.add(self.tab, page_idx, pg)
+        m = fitz.Matrix(zoom, zoom)  # 144 DPI at detail 1
+        pm = dlist.get_pixmap(matrix=m, alpha=False)
+        img = QtGui.QImage(pm.samples, pm.width, pm.height, pm.stride, QtGui.QImage.Format_RGB888).copy()
+        if self.color_mode == "dark":
+            img.invertPixels()
+        if cached:
+            self.page_cache.store(self.cache_key, page_idx, zoom, self.color_mode, img)
+        return img
+
+    def save_annotations(self, tab=None, autosave=False):
+        tab = tab or self.tab
+        if not tab.doc:
             return
-        annotations = self.collect_annotations()
-        annotation_path = os.path.splitext(self.pdf_path)[0] + '.annotations.json'
-        self._annotation_save_worker = AnnotationSaveWorker(annotation_path, annotations, self)
-        self._annotation_save_worker.saved.connect(lambda path: self.status.showMessage(f"Annotations saved to {path}", 3000))
-        self._annotation_save_worker.error.connect(lambda err: QtWidgets.QMessageBox.critical(self, "Save Error", f"Failed to save annotations: {err}"))
-        self._annotation_save_worker.start()
+        if autosave and tab.page_ops:
+            # Page edits cannot be undone, so only an explicit save writes them into the PDF. The
+            # sidecar's page numbers follow the edited structure, so it waits for that save too.
+            if tab is self.tab:
+                self.status.showMessage("Page changes are not autosaved; save to write them to the PDF", 5000)
+            return
+        if tab.saving:
+            # One save per document at a time; later requests collapse into a single follow-up
+            tab.save_pending = True
+            return
+        if tab.revision == tab.saved_revision and not tab.page_ops:
+            if tab is self.tab:
+                self.status.showMessage("No unsaved annotation changes", 3000)
+            return
+        revision = tab.revision
+        annotations = {'version': 3, 'native_keys': sorted(tab.native_keys),
+                       'layers': self.collect_layers(tab), 'annotations': self.collect_annotations(tab)}
+        annotation_path = os.path.splitext(tab.pdf_path)[0] + '.annotations.json'
+        tab.saving = True
+        if tab.page_ops:
+            # Page numbers in the sidecar follow the edited structure, so the PDF is written first
+            self._save_pages(tab, lambda: self._write_annotations(tab, annotation_path, annotations, revision))
+            return
+        self._write_annotations(tab, annotation_path, annotations, revision)
+
+    def _write_annotations(self, tab, annotation_path, annotations, revision):
+        worker = tab.save_worker = AnnotationSaveWorker(annotation_path, annotations, self)
+        worker.saved.connect(lambda path: self._annotations_saved(tab, revision, path))
+        worker.error.connect(lambda err: QtWidgets.QMessageBox.critical(self, "Save Error", f"Failed to save annotations: {err}"))
+        worker.finished.connect(lambda: self._save_finished(tab, worker))
+        worker.start()
+
+    def _annotations_saved(self, tab, revision, path):
+        tab.saved_revision = max(tab.saved_revision, revision)
+        self.status.showMessage(f"Annotations saved to {path}", 3000)
+
+    def _save_finished(self, tab, worker):
+        if tab.save_worker is not worker:
+            return
+        tab.save_worker = None
+        tab.saving = False
+        if tab.save_pending:
+            tab.save_pending = False
+            self.save_annotations(tab)
+
+    def _wait_for_saves(self, tab):
+        for worker in (tab.page_saver, tab.save_worker):
+            if worker:
+                worker.wait()
+        tab.page_saver = tab.save_worker = None
+        tab.saving = tab.save_pending = False
+
+    def _reset_page_ops(self, tab):
+        # Unsaved page edits belong to the document being replaced
+        self._wait_for_saves(tab)
+        tab.page_ops = []
+
+    def _autosave(self):
+        # Never snapshot in the middle of a stroke or a burst of edits; retry once input settles
+        if self.drawing or time.monotonic() - self._last_edit < AUTOSAVE_IDLE_MS / 1000:
+            self.autosave_retry.start()
+            return
+        for tab in self._tabs():
+            self.save_annotations(tab, autosave=True)
+
+    def _mark_dirty(self, item=None):
+        self.tab.revision += 1
+        self._last_edit = time.monotonic()
+        if item is not None:
+            self.tab.dirty_items.add(item)
+
+    def _item_released(self, item):
+        # Movable text and comment items are dragged by the view itself
+        if any(item in layer.items for layer in self.layers.values()):
+            self._mark_dirty(item)
+
+    def _save_pages(self, tab, then):
+        if tab.page_saver:
+            return
+        # The edits leave the queue as the save starts, so a save that is waited on is never replayed
+        ops, tab.page_ops = tab.page_ops, []
+        worker = PageSaveWorker(tab.pdf_path, ops, self)
+        worker.saved.connect(lambda path: self._pages_saved(tab, worker, then))
+        worker.error.connect(lambda err: self._pages_failed(tab, worker, ops, err))
+        worker.finished.connect(lambda: tab.page_saver is worker and setattr(tab, 'page_saver', None))
+        tab.page_saver = worker
+        worker.start()
+
+    def _pages_failed(self, tab, worker, ops, err):
+        if tab.page_saver is worker:
+            tab.page_ops[:0] = ops
+            tab.saving = False
+        QtWidgets.QMessageBox.critical(self, "Save Error", f"Failed to save page changes: {err}")
+
+    def _pages_saved(self, tab, worker, then):
+        if tab.page_saver is not worker:
+            # The document was closed or reloaded while the save was in flight
+            return
+        if not tab.page_ops:
+            tab.cache_key = self.page_cache.doc_key(tab.pdf_path)
+        self.status.showMessage(f"Page changes saved to {tab.pdf_path}", 3000)
+        then()
 
     def export_pdf(self):
         if not self.doc:
@@ -632,244 +2585,370 @@ class PDFAnnotator(QMainWindow):
         dest, _ = QFileDialog.getSaveFileName(self, "Export Annotated PDF", "", "PDF Files (*.pdf)")
         if not dest:
             return
+        if self.tab.importer or self.tab.import_queue:
+            QtWidgets.QMessageBox.warning(self, "Export", "Annotations stored in the PDF are still being imported; try again once the import finishes.")
+            return
+        profiles = list(EXPORT_PROFILES)
+        last = self.settings.value("export_profile", "balanced")
+        profile, ok = QInputDialog.getItem(self, "Export Annotated PDF", "Profile:", profiles,
+                                           profiles.index(last) if last in profiles else 0, False)
+        if not ok:
+            return
+        self.settings.setValue("export_profile", profile)
         annotations = self.collect_annotations()
-        self._save_worker = SaveWorker(dest, self.pdf_path, annotations, self.render_zoom, self)
-        self._save_worker.saved.connect(lambda path: self.status.showMessage(f"Exported to {path}", 3000))
+        self._save_worker = SaveWorker(dest, self.pdf_path, annotations, self.render_zoom, self,
+                                       native_keys=self.tab.native_keys, page_ops=self.tab.page_ops,
+                                       profile=profile, linearize=self.linearize_action.isChecked())
+        self._save_worker.report.connect(lambda report: self.status.showMessage(f"Exported to {dest}: {_size_summary(report)}", 10000))
         self._save_worker.error.connect(lambda err: QtWidgets.QMessageBox.critical(self, "Export Error", f"Failed to export: {err}"))
         self._save_worker.start()
 
-    def collect_annotations(self):
+    def export_images(self):
+        if not self.doc:
+            return
+        if self.tab.importer or self.tab.import_queue:
+            QtWidgets.QMessageBox.warning(self, "Export", "Annotations stored in the PDF are still being imported; try again once the import finishes.")
+            return
+        out_dir = QFileDialog.getExistingDirectory(self, "Export Pages as Images")
+        if not out_dir:
+            return
+        fmt, ok = QInputDialog.getItem(self, "Export Pages as Images", "Format:", list(IMAGE_FORMATS), 0, False)
+        if not ok:
+            return
+        dpi, ok = QInputDialog.getInt(self, "Export Pages as Images", "Resolution (DPI):", EXPORT_DPI, 36, 1200)
+        if not ok:
+            return
+        worker = self._image_export_worker = ImageExportWorker(out_dir, self.pdf_path, self.collect_annotations(), self.render_zoom, self,
+                                                               native_keys=self.tab.native_keys, page_ops=self.tab.page_ops, dpi=dpi, fmt=fmt)
+        progress = QProgressDialog("Exporting pages...", "Cancel", 0, self.doc.page_count, self)
+        progress.setWindowModality(QtCore.Qt.WindowModal)
+        progress.setMinimumDuration(500)
+        progress.canceled.connect(worker.requestInterruption)
+        worker.progress.connect(lambda done, total: progress.setValue(done))
+        worker.exported.connect(self._images_exported)
+        worker.error.connect(lambda err: QtWidgets.QMessageBox.critical(self, "Export Error", f"Failed to export images: {err}"))
+        worker.finished.connect(progress.close)
+        worker.start()
+
+    def _images_exported(self, report):
+        page_ms = report["page_ms"]
+        self.status.showMessage(
+            f"Exported {report['pages']}/{report['of']} pages in {report['wall_s']:.1f} s on {report['jobs']} processes"
+            + (f" ({page_ms['p50']:.0f} ms/page median, {page_ms['max']:.0f} ms slowest)" if page_ms else ""), 10000)
+
+    def collect_layers(self, tab=None):
+        return [layer.state() for layer in (tab or self.tab).layers.values()]
+
+    def collect_annotations(self, tab=None):
+        # Records are cached per item and rebuilt only for items marked dirty since the last
+        # snapshot, so an autosave costs one dictionary lookup per unchanged annotation
+        tab = tab or self.tab
         annotations = []
-        for layer_name, layer_items in self.layers.items():
-            for item, page_idx in layer_items:
-                if isinstance(item, QGraphicsPathItem):
-                    path = item.path()
-                    strokes = []
-                    current_stroke = []
-                    for i in range(path.elementCount()):
-                        elem = path.elementAt(i)
-                        if elem.isMoveTo():
-                            if current_stroke:
-                                strokes.append(current_stroke)
-                            current_stroke = [[elem.x / self.render_zoom, elem.y / self.render_zoom]]
-                        elif elem.isLineTo():
-                            current_stroke.append([elem.x / self.render_zoom, elem.y / self.render_zoom])
+        for layer_name, layer in tab.layers.items():
+            for item, page_idx in layer.items.items():
+                if item in tab.native_items:
+                    continue
+                record = tab.records.get(item, False)
+                if record is False or item in tab.dirty_items or (record and (record['page'], record['layer']) != (page_idx, layer_name)):
+                    record = tab.records[item] = self._annotation_record(tab, item, layer_name, page_idx)
+                if record:
+                    annotations.append(record)
+        tab.dirty_items.clear()
+        return annotations
+
+    def _annotation_record(self, tab, item, layer_name, page_idx):
+        if isinstance(item, InkStrokeItem):
+            points = item.points
+            pressure = [round(points[i], 3) for i in range(2, len(points), 3)]
+            record = {
+                'layer': layer_name,
+                'page': page_idx,
+                'type': 'path',
+                'strokes': [[[points[i] / self.render_zoom, points[i + 1] / self.render_zoom] for i in range(0, len(points), 3)]],
+                'color': list(item.color().getRgbF()[:3]),
+                'opacity': item.color().alphaF(),
+                'width': item.base_width
+            }
+            if len(set(pressure)) == 1:
+                # Mouse strokes carry no pressure; a plain path at the drawn width is the same stroke
+                record['width'] = _ink_width(item.base_width, pressure[0])
+            else:
+                record['pressure'] = [pressure]
+            return record
+        elif isinstance(item, HighlightItem):
+            z = self.render_zoom
+            return {
+                'layer': layer_name,
+                'page': page_idx,
+                'type': 'highlight',
+                'quads': [[q.left() / z, q.top() / z, q.right() / z, q.bottom() / z] for q in item.quads],
+                'color': list(item.color().getRgbF()[:3]),
+                'opacity': item.color().alphaF()
+            }
+        elif isinstance(item, QGraphicsPathItem):
+            path = item.path()
+            strokes = []
+            current_stroke = []
+            for i in range(path.elementCount()):
+                elem = path.elementAt(i)
+                if elem.isMoveTo():
                     if current_stroke:
                         strokes.append(current_stroke)
-                    color = list(item.pen().color().getRgbF()[:3])
-                    width = item.pen().widthF()
-                    annotations.append({
-                        'layer': layer_name,
-                        'page': page_idx,
-                        'type': 'path',
-                        'strokes': strokes,
-                        'color': color,
-                        'width': width
-                    })
-                elif isinstance(item, QGraphicsLineItem):
-                    line = item.line()
-                    color = list(item.pen().color().getRgbF()[:3])
-                    width = item.pen().widthF()
-                    annotations.append({
-                        'layer': layer_name,
-                        'page': page_idx,
-                        'type': 'line',
-                        'points': [line.x1() / self.render_zoom, line.y1() / self.render_zoom, line.x2() / self.render_zoom, line.y2() / self.render_zoom],
-                        'color': color,
-                        'width': width
-                    })
-                elif isinstance(item, QGraphicsRectItem):
-                    rect = item.rect()
-                    color = list(item.pen().color().getRgbF()[:3])
-                    width = item.pen().widthF()
-                    annotations.append({
-                        'layer': layer_name,
-                        'page': page_idx,
-                        'type': 'rect',
-                        'rect': [rect.x() / self.render_zoom, rect.y() / self.render_zoom, rect.width() / self.render_zoom, rect.height() / self.render_zoom],
-                        'color': color,
-                        'width': width
-                    })
-                elif isinstance(item, QGraphicsEllipseItem) and not item.toolTip():
-                    rect = item.rect()
-                    color = list(item.pen().color().getRgbF()[:3])
-                    width = item.pen().widthF()
-                    annotations.append({
-                        'layer': layer_name,
-                        'page': page_idx,
-                        'type': 'ellipse',
-                        'rect': [rect.x() / self.render_zoom, rect.y() / self.render_zoom, rect.width() / self.render_zoom, rect.height() / self.render_zoom],
-                        'color': color,
-                        'width': width
-                    })
-                elif isinstance(item, QGraphicsTextItem):
-                    pos = item.pos()
-                    text = item.toPlainText()
-                    font_size = item.font().pointSizeF()
-                    color = list(item.defaultTextColor().getRgbF()[:3])
-                    annotations.append({
-                        'layer': layer_name,
-                        'page': page_idx,
-                        'type': 'text',
-                        'data': [pos.x() / self.render_zoom, pos.y() / self.render_zoom, text, font_size],
-                        'color': color
-                    })
-                elif isinstance(item, QGraphicsEllipseItem) and item.toolTip():
-                    pos = item.pos()
-                    comment = item.toolTip()
-                    annotations.append({
-                        'layer': layer_name,
-                        'page': page_idx,
-                        'type': 'comment',
-                        'data': [pos.x() / self.render_zoom, pos.y() / self.render_zoom, comment]
-                    })
-        return annotations
+                    current_stroke = [[elem.x / self.render_zoom, elem.y / self.render_zoom]]
+                elif elem.isLineTo():
+                    current_stroke.append([elem.x / self.render_zoom, elem.y / self.render_zoom])
+            if current_stroke:
+                strokes.append(current_stroke)
+            color = list(item.pen().color().getRgbF()[:3])
+            width = item.pen().widthF()
+            return {
+                'layer': layer_name,
+                'page': page_idx,
+                'type': 'path',
+                'strokes': strokes,
+                'color': color,
+                'opacity': item.pen().color().alphaF(),
+                'width': width
+            }
+        elif isinstance(item, QGraphicsLineItem):
+            line = item.line()
+            color = list(item.pen().color().getRgbF()[:3])
+            width = item.pen().widthF()
+            return {
+                'layer': layer_name,
+                'page': page_idx,
+                'type': 'line',
+                'points': [line.x1() / self.render_zoom, line.y1() / self.render_zoom, line.x2() / self.render_zoom, line.y2() / self.render_zoom],
+                'color': color,
+                'width': width
+            }
+        elif isinstance(item, QGraphicsRectItem):
+            rect = item.rect()
+            color = list(item.pen().color().getRgbF()[:3])
+            width = item.pen().widthF()
+            return {
+                'layer': layer_name,
+                'page': page_idx,
+                'type': 'rect',
+                'rect': [rect.x() / self.render_zoom, rect.y() / self.render_zoom, rect.width() / self.render_zoom, rect.height() / self.render_zoom],
+                'color': color,
+                'width': width
+            }
+        elif isinstance(item, QGraphicsEllipseItem) and not item.toolTip():
+            rect = item.rect()
+            color = list(item.pen().color().getRgbF()[:3])
+            width = item.pen().widthF()
+            return {
+                'layer': layer_name,
+                'page': page_idx,
+                'type': 'ellipse',
+                'rect': [rect.x() / self.render_zoom, rect.y() / self.render_zoom, rect.width() / self.render_zoom, rect.height() / self.render_zoom],
+                'color': color,
+                'width': width
+            }
+        elif isinstance(item, QGraphicsTextItem):
+            pos = item.pos() - tab.page_items[page_idx].pos()
+            text = item.toPlainText()
+            font_size = item.font().pointSizeF()
+            color = list(item.defaultTextColor().getRgbF()[:3])
+            record = {
+                'layer': layer_name,
+                'page': page_idx,
+                'type': 'text',
+                'data': [pos.x() / self.render_zoom, pos.y() / self.render_zoom, text, font_size],
+                'color': color
+            }
+            if item.textWidth() > 0:
+                # Imported text keeps its box; the box is stored as the rect it covers on the page
+                z = self.render_zoom
+                box = QtCore.QRectF(0, 0, item.textWidth(), max(item.boundingRect().height(), item.data(QtCore.Qt.UserRole) or 0))
+                box = item.mapRectToScene(box).translated(-tab.page_items[page_idx].pos())
+                record['data'][:2] = [box.x() / z, box.y() / z]
+                record['size'] = [box.width() / z, box.height() / z]
+                if item.rotation():
+                    record['rotate'] = round(-item.rotation()) % 360
+            return record
+        elif isinstance(item, QGraphicsEllipseItem) and item.toolTip():
+            pos = item.pos() - tab.page_items[page_idx].pos()
+            comment = item.toolTip()
+            return {
+                'layer': layer_name,
+                'page': page_idx,
+                'type': 'comment',
+                'data': [pos.x() / self.render_zoom, pos.y() / self.render_zoom, comment]
+            }
+        return None
 
     def _load_annotations(self):
+        # Returns True for a sidecar that says the PDF's annotations were imported without naming them
         annotation_path = os.path.splitext(self.pdf_path)[0] + '.annotations.json'
+        adopt = False
         if not os.path.exists(annotation_path):
-            return
+            return adopt
         try:
             with open(annotation_path, 'r') as f:
                 annotations = json.load(f)
+            if isinstance(annotations, dict):
+                states = annotations.get('layers', [])
+                for state in states:
+                    self._ensure_layer(state['name']).apply_state(state)
+                order = [state['name'] for state in states]
+                self.layers = {name: self.layers[name] for name in order + [n for n in self.layers if n not in order]}
+                self._restack_layers()
+                self.tab.native_keys = set(annotations.get('native_keys', ()))
+                adopt = 'native_keys' not in annotations and annotations.get('native_imported', False)
+                annotations = annotations['annotations']
             for ann in annotations:
-                layer_name = ann['layer']
-                if layer_name not in self.layers:
-                    self.layers[layer_name] = []
-                    self.layer_combo.addItem(layer_name)
-                page_idx = ann['page']
-                ann_type = ann['type']
-                if ann_type == 'path':
-                    strokes = [[[p[0] * self.render_zoom, p[1] * self.render_zoom] for p in stroke] for stroke in ann['strokes']]
-                    color = QtGui.QColor.fromRgbF(*ann['color'], 1.0)
-                    width = ann['width']
-                    pen = QtGui.QPen(color, width, QtCore.Qt.SolidLine, QtCore.Qt.RoundCap, QtCore.Qt.RoundJoin)
-                    item = QGraphicsPathItem()
-                    item.setPen(pen)
-                    path = QtGui.QPainterPath()
-                    for stroke in strokes:
-                        path.moveTo(*stroke[0])
-                        for point in stroke[1:]:
-                            path.lineTo(*point)
-                    item.setPath(path)
-                    item.setPos(self.page_items[page_idx].pos())
-                    self.scene.addItem(item)
-                    self.layers[layer_name].append((item, page_idx))
-                elif ann_type == 'line':
-                    x1, y1, x2, y2 = [p * self.render_zoom for p in ann['points']]
-                    color = QtGui.QColor.fromRgbF(*ann['color'], 1.0)
-                    width = ann['width']
-                    pen = QtGui.QPen(color, width, QtCore.Qt.SolidLine, QtCore.Qt.RoundCap, QtCore.Qt.RoundJoin)
-                    item = QGraphicsLineItem(x1, y1, x2, y2)
-                    item.setPen(pen)
-                    item.setPos(self.page_items[page_idx].pos())
-                    self.scene.addItem(item)
-                    self.layers[layer_name].append((item, page_idx))
-                elif ann_type == 'rect':
-                    x, y, w, h = [p * self.render_zoom for p in ann['rect']]
-                    color = QtGui.QColor.fromRgbF(*ann['color'], 1.0)
-                    width = ann['width']
-                    pen = QtGui.QPen(color, width, QtCore.Qt.SolidLine)
-                    item = QGraphicsRectItem(x, y, w, h)
-                    item.setPen(pen)
-                    item.setBrush(QtGui.QBrush(QtCore.Qt.NoBrush))
-                    item.setPos(self.page_items[page_idx].pos())
-                    self.scene.addItem(item)
-                    self.layers[layer_name].append((item, page_idx))
-                elif ann_type == 'ellipse':
-                    x, y, w, h = [p * self.render_zoom for p in ann['rect']]
-                    color = QtGui.QColor.fromRgbF(*ann['color'], 1.0)
-                    width = ann['width']
-                    pen = QtGui.QPen(color, width, QtCore.Qt.SolidLine)
-                    item = QGraphicsEllipseItem(x, y, w, h)
-                    item.setPen(pen)
-                    item.setBrush(QtGui.QBrush(QtCore.Qt.NoBrush))
-                    item.setPos(self.page_items[page_idx].pos())
-                    self.scene.addItem(item)
-                    self.layers[layer_name].append((item, page_idx))
-                elif ann_type == 'text':
-                    x, y, text, font_size = ann['data']
-                    x, y, font_size = x * self.render_zoom, y * self.render_zoom, font_size
-                    color = QtGui.QColor.fromRgbF(*ann['color'], 1.0)
-                    item = QGraphicsTextItem(text)
-                    item.setDefaultTextColor(color)
-                    item.setFont(QtGui.QFont("Arial", font_size))
-                    item.setPos(self.page_items[page_idx].pos() + QtCore.QPointF(x, y))
-                    item.setFlag(QtWidgets.QGraphicsItem.ItemIsMovable)
-                    item.setFlag(QtWidgets.QGraphicsItem.ItemIsSelectable)
-                    self.scene.addItem(item)
-                    self.layers[layer_name].append((item, page_idx))
-                elif ann_type == 'comment':
-                    x, y, comment = ann['data']
-                    x, y = x * self.render_zoom, y * self.render_zoom
-                    item = QGraphicsEllipseItem(-8, -8, 16, 16)
-                    item.setBrush(QtGui.QColor(255, 255, 0))
-                    item.setPen(QtGui.QPen(QtGui.QColor(0, 0, 0), 1))
-                    item.setToolTip(comment)
-                    item.setFlag(QtWidgets.QGraphicsItem.ItemIsMovable)
-                    item.setPos(self.page_items[page_idx].pos() + QtCore.QPointF(x, y))
-                    self.scene.addItem(item)
-                    self.layers[layer_name].append((item, page_idx))
+                item = self._annotation_item(ann)
+                if item is not None:
+                    self._attach_item(item, ann['page'], ann['layer'])
         except Exception as e:
             QtWidgets.QMessageBox.warning(self, "Load Error", f"Failed to load annotations: {str(e)}")
+        self.tab.saved_revision = self.tab.revision
+        self._refresh_layer_list()
+        return adopt
+
+    def _annotation_item(self, ann):
+        page_idx = ann['page']
+        ann_type = ann['type']
+        if ann_type == 'path' and 'pressure' in ann:
+            item = InkStrokeItem(QtGui.QColor.fromRgbF(*ann['color'], ann.get('opacity', 1.0)), ann['width'])
+            item.add_points([(p[0] * self.render_zoom, p[1] * self.render_zoom, pressure)
+                             for p, pressure in zip(ann['strokes'][0], ann['pressure'][0])])
+            item.finish()
+            item.setPos(self.page_items[page_idx].pos())
+        elif ann_type == 'path':
+            strokes = [[[p[0] * self.render_zoom, p[1] * self.render_zoom] for p in stroke] for stroke in ann['strokes']]
+            color = QtGui.QColor.fromRgbF(*ann['color'], ann.get('opacity', 1.0))
+            width = ann['width']
+            pen = QtGui.QPen(color, width, QtCore.Qt.SolidLine, QtCore.Qt.RoundCap, QtCore.Qt.RoundJoin)
+            item = QGraphicsPathItem()
+            item.setPen(pen)
+            path = QtGui.QPainterPath()
+            for stroke in strokes:
+                path.moveTo(*stroke[0])
+                for point in stroke[1:]:
+                    path.lineTo(*point)
+            item.setPath(path)
+            item.setPos(self.page_items[page_idx].pos())
+        elif ann_type == 'line':
+            x1, y1, x2, y2 = [p * self.render_zoom for p in ann['points']]
+            color = QtGui.QColor.fromRgbF(*ann['color'], 1.0)
+            width = ann['width']
+            pen = QtGui.QPen(color, width, QtCore.Qt.SolidLine, QtCore.Qt.RoundCap, QtCore.Qt.RoundJoin)
+            item = QGraphicsLineItem(x1, y1, x2, y2)
+            item.setPen(pen)
+            item.setPos(self.page_items[page_idx].pos())
+        elif ann_type == 'rect':
+            x, y, w, h = [p * self.render_zoom for p in ann['rect']]
+            color = QtGui.QColor.fromRgbF(*ann['color'], 1.0)
+            width = ann['width']
+            pen = QtGui.QPen(color, width, QtCore.Qt.SolidLine)
+            item = QGraphicsRectItem(x, y, w, h)
+            item.setPen(pen)
+            item.setBrush(QtGui.QBrush(QtCore.Qt.NoBrush))
+            item.setPos(self.page_items[page_idx].pos())
+        elif ann_type == 'ellipse':
+            x, y, w, h = [p * self.render_zoom for p in ann['rect']]
+            color = QtGui.QColor.fromRgbF(*ann['color'], 1.0)
+            width = ann['width']
+            pen = QtGui.QPen(color, width, QtCore.Qt.SolidLine)
+            item = QGraphicsEllipseItem(x, y, w, h)
+            item.setPen(pen)
+            item.setBrush(QtGui.QBrush(QtCore.Qt.NoBrush))
+            item.setPos(self.page_items[page_idx].pos())
+        elif ann_type == 'text':
+            x, y, text, font_size = ann['data']
+            x, y, font_size = x * self.render_zoom, y * self.render_zoom, font_size
+            color = QtGui.QColor.fromRgbF(*ann['color'], 1.0)
+            item = QGraphicsTextItem(text)
+            item.setDefaultTextColor(color)
+            item.setFont(QtGui.QFont("Arial", round(font_size)))
+            if 'size' in ann:
+                # Wrap inside the box and start the first line at the corner the rotation puts it in
+                w, h = ann['size'][0] * self.render_zoom, ann['size'][1] * self.render_zoom
+                rotate = ann.get('rotate', 0)
+                across = rotate in (90, 270)
+                item.setTextWidth(h if across else w)
+                item.setData(QtCore.Qt.UserRole, w if across else h)
+                item.setRotation(-rotate)
+                x, y = {90: (x, y + h), 180: (x + w, y + h), 270: (x + w, y)}.get(rotate, (x, y))
+            item.setPos(self.page_items[page_idx].pos() + QtCore.QPointF(x, y))
+            item.setFlag(QtWidgets.QGraphicsItem.ItemIsMovable)
+            item.setFlag(QtWidgets.QGraphicsItem.ItemIsSelectable)
+        elif ann_type == 'comment':
+            x, y, comment = ann['data']
+            x, y = x * self.render_zoom, y * self.render_zoom
+            item = QGraphicsEllipseItem(-8, -8, 16, 16)
+            item.setBrush(QtGui.QColor(255, 255, 0))
+            item.setPen(QtGui.QPen(QtGui.QColor(0, 0, 0), 1))
+            item.setToolTip(comment)
+            item.setFlag(QtWidgets.QGraphicsItem.ItemIsMovable)
+            item.setPos(self.page_items[page_idx].pos() + QtCore.QPointF(x, y))
+        elif ann_type == 'highlight':
+            z = self.render_zoom
+            color = QtGui.QColor.fromRgbF(*ann['color'], ann.get('opacity', 1.0))
+            item = HighlightItem(color, [QtCore.QRectF(x0 * z, y0 * z, (x1 - x0) * z, (y1 - y0) * z) for x0, y0, x1, y1 in ann['quads']])
+            item.setPos(self.page_items[page_idx].pos())
+        else:
+            return None
+        return item
 
     def _start_tool(self, ev):
-        pos = self.view.mapToScene(ev.pos())
+        pos = self.view.scene_point(_event_pos(ev))
         page_idx = self._get_page_at(pos)
         if page_idx is None:
             return
         page_pos = self.page_items[page_idx].pos()
         local_pos = pos - page_pos
+        if self.current_tool == "select":
+            self._start_selection(page_idx, local_pos)
+            return
+        layer = self.layers[self.current_layer]
+        if self.current_tool != "eraser" and (layer.locked or not layer.visible):
+            self.status.showMessage(f"Layer '{self.current_layer}' is {'locked' if layer.locked else 'hidden'}", 3000)
+            return
+        self._activate_page(page_idx)
+        self.undo_stack.begin()
         color = QtGui.QColor(self.pen_color)
         if self.current_tool == "high":
             color.setAlpha(120)
         pen = QtGui.QPen(color, self.pen_width, QtCore.Qt.SolidLine, QtCore.Qt.RoundCap, QtCore.Qt.RoundJoin)
         
         if self.current_tool in ["pen", "high"]:
-            item = QGraphicsPathItem()
-            item.setPen(pen)
-            path = QtGui.QPainterPath()
-            path.moveTo(local_pos)
-            item.setPath(path)
+            item = InkStrokeItem(color, self.pen_width)
             item.setPos(page_pos)
-            self.scene.addItem(item)
+            item.add_points([(local_pos.x(), local_pos.y(), _event_pressure(ev))])
             self.current_item = item
             self.drawing = True
-            self.layers[self.current_layer].append((item, page_idx))
-            self.history.append(("add", item, page_idx, self.current_layer))
-            self.redo_stack.clear()
+            self._attach_item(item, page_idx, self.current_layer)
+            self.undo_stack.push("add", item, page_idx, self.current_layer)
         elif self.current_tool in ["line", "arrow"]:
             item = QGraphicsLineItem(local_pos.x(), local_pos.y(), local_pos.x(), local_pos.y())
             item.setPen(pen)
             item.setPos(page_pos)
-            self.scene.addItem(item)
             self.current_item = item
             self.drawing = True
-            self.layers[self.current_layer].append((item, page_idx))
-            self.history.append(("add", item, page_idx, self.current_layer))
-            self.redo_stack.clear()
+            self._attach_item(item, page_idx, self.current_layer)
+            self.undo_stack.push("add", item, page_idx, self.current_layer)
         elif self.current_tool == "rect":
             item = QGraphicsRectItem(local_pos.x(), local_pos.y(), 0, 0)
             item.setPen(pen)
             item.setBrush(QtGui.QBrush(QtCore.Qt.NoBrush))
             item.setPos(page_pos)
-            self.scene.addItem(item)
             self.current_item = item
             self.drawing = True
-            self.layers[self.current_layer].append((item, page_idx))
-            self.history.append(("add", item, page_idx, self.current_layer))
-            self.redo_stack.clear()
+            self._attach_item(item, page_idx, self.current_layer)
+            self.undo_stack.push("add", item, page_idx, self.current_layer)
         elif self.current_tool == "ellipse":
             item = QGraphicsEllipseItem(local_pos.x(), local_pos.y(), 0, 0)
             item.setPen(pen)
             item.setBrush(QtGui.QBrush(QtCore.Qt.NoBrush))
             item.setPos(page_pos)
-            self.scene.addItem(item)
             self.current_item = item
             self.drawing = True
-            self.layers[self.current_layer].append((item, page_idx))
-            self.history.append(("add", item, page_idx, self.current_layer))
-            self.redo_stack.clear()
+            self._attach_item(item, page_idx, self.current_layer)
+            self.undo_stack.push("add", item, page_idx, self.current_layer)
         elif self.current_tool == "text":
             text, ok = QInputDialog.getText(self, "Text", "Enter text:")
             if ok and text:
@@ -879,10 +2958,9 @@ class PDFAnnotator(QMainWindow):
                 item.setPos(page_pos + local_pos)
                 item.setFlag(QtWidgets.QGraphicsItem.ItemIsMovable)
                 item.setFlag(QtWidgets.QGraphicsItem.ItemIsSelectable)
-                self.scene.addItem(item)
-                self.layers[self.current_layer].append((item, page_idx))
-                self.history.append(("add", item, page_idx, self.current_layer))
-                self.redo_stack.clear()
+                self._attach_item(item, page_idx, self.current_layer)
+                self.undo_stack.push("add", item, page_idx, self.current_layer)
+            self.undo_stack.commit()
         elif self.current_tool == "comment":
             comment, ok = QInputDialog.getMultiLineText(self, "Comment", "Enter comment:")
             if ok and comment:
@@ -892,10 +2970,9 @@ class PDFAnnotator(QMainWindow):
                 item.setToolTip(comment)
                 item.setFlag(QtWidgets.QGraphicsItem.ItemIsMovable)
                 item.setPos(page_pos + local_pos)
-                self.scene.addItem(item)
-                self.layers[self.current_layer].append((item, page_idx))
-                self.history.append(("add", item, page_idx, self.current_layer))
-                self.redo_stack.clear()
+                self._attach_item(item, page_idx, self.current_layer)
+                self.undo_stack.push("add", item, page_idx, self.current_layer)
+            self.undo_stack.commit()
         elif self.current_tool == "eraser":
             self.drawing = True
             self.current_item = None
@@ -903,16 +2980,18 @@ class PDFAnnotator(QMainWindow):
     def _move_tool(self, ev):
         if not self.drawing:
             return
-        pos = self.view.mapToScene(ev.pos())
+        pos = self.view.scene_point(_event_pos(ev))
+        if self.current_tool == "select":
+            self._extend_selection(pos)
+            return
         page_idx = self._get_page_at(pos)
         if page_idx is None:
             return
         page_pos = self.page_items[page_idx].pos()
         local_pos = pos - page_pos
         if self.current_tool in ["pen", "high"] and self.current_item:
-            path = self.current_item.path()
-            path.lineTo(local_pos)
-            self.current_item.setPath(path)
+            local_pos = pos - self.current_item.pos()
+            self.current_item.add_points([(local_pos.x(), local_pos.y(), _event_pressure(ev))])
         elif self.current_tool in ["line", "arrow"] and self.current_item:
             line = self.current_item.line()
             self.current_item.setLine(line.x1(), line.y1(), local_pos.x(), local_pos.y())
@@ -920,28 +2999,338 @@ class PDFAnnotator(QMainWindow):
             rect = QtCore.QRectF(QtCore.QPointF(self.current_item.rect().x(), self.current_item.rect().y()), local_pos).normalized()
             self.current_item.setRect(rect)
         elif self.current_tool == "eraser":
+            self._activate_page(page_idx)
             rect = QtCore.QRectF(pos - QtCore.QPointF(10, 10), QtCore.QSizeF(20, 20))
             items = self.scene.items(rect)
+            page_annotations = self.tab.page_annotations.get(page_idx, {})
             for item in items:
-                if isinstance(item, (QGraphicsPathItem, QGraphicsLineItem, QGraphicsRectItem, QGraphicsEllipseItem, QGraphicsTextItem)):
-                    for layer_name, layer_items in self.layers.items():
-                        for i, (it, pg) in enumerate(layer_items):
-                            if it == item and pg == page_idx:
-                                del layer_items[i]
-                                self.scene.removeItem(item)
-                                self.history.append(("remove", item, page_idx, layer_name))
-                                self.redo_stack.clear()
-                                break
+                layer_name = page_annotations.get(item)
+                if layer_name is None or self.layers[layer_name].locked:
+                    continue
+                self._detach_item(item, page_idx, layer_name)
+                self.undo_stack.push("remove", item, page_idx, layer_name)
+
+    def _move_tool_samples(self, samples):
+        # Coalesced tablet moves: a pen stroke takes the whole batch and rebuilds its outline once
+        if self.current_tool in ["pen", "high"] and isinstance(self.current_item, InkStrokeItem):
+            origin = self.current_item.pos()
+            points = []
+            for pos, pressure in samples:
+                local_pos = self.view.scene_point(pos) - origin
+                points.append((local_pos.x(), local_pos.y(), pressure))
+            self.current_item.add_points(points)
+        elif self.current_tool == "eraser":
+            for pos, pressure in samples:
+                self._move_tool(TraceEvent(pos.x(), pos.y(), pressure))
+        else:
+            pos, pressure = samples[-1]
+            self._move_tool(TraceEvent(pos.x(), pos.y(), pressure))
 
     def _end_tool(self, ev):
+        if isinstance(self.current_item, InkStrokeItem):
+            self.current_item.finish()
+        if self.current_item is not None:
+            self._mark_dirty(self.current_item)
         self.drawing = False
         self.current_item = None
+        self.undo_stack.commit()
+        self.flatten_timer.start()
+
+    def _start_selection(self, page_idx, local_pos):
+        text = self.text_cache.get(self.tab, page_idx)
+        hit = text.hit(local_pos.x() / self.render_zoom, local_pos.y() / self.render_zoom)
+        self.tab.selection = None if hit is None else [page_idx, hit, hit]
+        self.drawing = hit is not None
+        self._update_selection_item()
+
+    def _extend_selection(self, pos):
+        # Uses the cached geometry of the page the selection started on; nothing is re-extracted while dragging
+        selection = self.tab.selection
+        if not selection:
+            return
+        page_idx = selection[0]
+        local_pos = pos - self.page_items[page_idx].pos()
+        text = self.text_cache.get(self.tab, page_idx)
+        hit = text.hit(local_pos.x() / self.render_zoom, local_pos.y() / self.render_zoom)
+        if hit is not None and hit != selection[2]:
+            selection[2] = hit
+            self._update_selection_item()
+
+    def _selection_range(self):
+        page_idx, anchor, focus = self.tab.selection
+        return page_idx, min(anchor, focus), max(anchor, focus)
+
+    def _update_selection_item(self):
+        tab = self.tab
+        if not tab.selection:
+            if tab.selection_item:
+                tab.selection_item.hide()
+            return
+        if tab.selection_item is None:
+            tab.selection_item = QGraphicsPathItem()
+            tab.selection_item.setPen(QtGui.QPen(QtCore.Qt.NoPen))
+            tab.selection_item.setBrush(QtGui.QColor(38, 166, 154, 90))
+            tab.selection_item.setZValue(1)
+            tab.scene.addItem(tab.selection_item)
+        page_idx, start, end = self._selection_range()
+        path = QtGui.QPainterPath()
+        z = self.render_zoom
+        for x0, y0, x1, y1 in self.text_cache.get(tab, page_idx).quads(start, end):
+            path.addRect(QtCore.QRectF(x0 * z, y0 * z, (x1 - x0) * z, (y1 - y0) * z))
+        tab.selection_item.setPath(path)
+        tab.selection_item.setPos(self.page_items[page_idx].pos())
+        tab.selection_item.show()
+
+    def _clear_selection(self):
+        self.tab.selection = None
+        self._update_selection_item()
+
+    def copy_selection(self):
+        if not self.tab.selection:
+            return
+        page_idx, start, end = self._selection_range()
+        text = self.text_cache.get(self.tab, page_idx).selected_text(start, end)
+        QApplication.clipboard().setText(text)
+        self.status.showMessage(f"Copied {len(text)} characters", 3000)
+
+    def highlight_selection(self):
+        if not self.tab.selection:
+            return
+        layer = self.layers[self.current_layer]
+        if layer.locked or not layer.visible:
+            self.status.showMessage(f"Layer '{self.current_layer}' is {'locked' if layer.locked else 'hidden'}", 3000)
+            return
+        page_idx, start, end = self._selection_range()
+        text = self.text_cache.get(self.tab, page_idx)
+        z = self.render_zoom
+        quads = [QtCore.QRectF(x0 * z, y0 * z, (x1 - x0) * z, (y1 - y0) * z)
+                 for x0, y0, x1, y1 in text.quads(*text.snap_to_words(start, end))]
+        color = QtGui.QColor(self.pen_color)
+        color.setAlpha(120)
+        item = HighlightItem(color, quads)
+        item.setPos(self.page_items[page_idx].pos())
+        self._activate_page(page_idx)
+        self.undo_stack.begin()
+        self._attach_item(item, page_idx, self.current_layer)
+        self.undo_stack.push("add", item, page_idx, self.current_layer)
+        self.undo_stack.commit()
+        self._clear_selection()
+        self.flatten_timer.start()
+
+    def _attach_item(self, item, page_idx, layer):
+        self._mark_dirty(item)
+        self._ensure_layer(layer).add(item, page_idx)
+        self.tab.page_annotations.setdefault(page_idx, {})[item] = layer
+        item.show()
+        self._annotations_changed(page_idx)
+
+    def _detach_item(self, item, page_idx, layer):
+        self._mark_dirty()
+        self.tab.records.pop(item, None)
+        self.layers[layer].discard(item)
+        del self.tab.page_annotations[page_idx][item]
+        self._annotations_changed(page_idx)
+
+    def _reset_annotation_state(self):
+        self._stop_import(self.tab)
+        self._stop_diff(self.tab)
+        self.tab.diff_items = {}
+        self.tab.diff_ranking = []
+        self.text_cache.release(self.tab)
+        self.tab.selection = None
+        self.tab.selection_item = None
+        self.tab.records = {}
+        self.tab.dirty_items = set()
+        self.tab.native_items = set()
+        self.tab.native_keys = set()
+        self.tab.import_keys = set()
+        self.layers = {"Default": Layer("Default", self.scene)}
+        self.tab.page_annotations = {}
+        self.tab.overlays = {}
+        self.tab.dirty_overlays = set()
+        self.tab.active_page = None
+
+    def _clear_annotations(self):
+        # Overlays are children of the layer roots, which are deleted below
+        for page_idx in list(self.tab.overlays):
+            self._unflatten_page(self.tab, page_idx)
+        for layer in self.layers.values():
+            self.scene.removeItem(layer.root)
+        if self.tab.selection_item:
+            self.scene.removeItem(self.tab.selection_item)
+        for item in self.tab.diff_items.values():
+            self.scene.removeItem(item)
+        self._reset_annotation_state()
+
+    def _import_native_annotations(self, path=None, start_at=0, adopt=False):
+        tab = self.tab
+        worker = AnnotationImportWorker(path or tab.pdf_path, self.render_zoom, self, start_at, tab.native_keys, adopt)
+        worker.batch.connect(lambda records: self._queue_imported(tab, worker, records))
+        worker.error.connect(lambda err: QtWidgets.QMessageBox.warning(self, "Import Error", f"Failed to import PDF annotations: {err}"))
+        worker.finished.connect(lambda: self._import_finished(tab, worker))
+        tab.importer = worker
+        worker.start()
+
+    def _queue_imported(self, tab, worker, records):
+        if tab.importer is not worker:
+            return
+        tab.import_queue.extend(records)
+        if tab is self.tab:
+            self.import_timer.start()
+
+    def _attach_imported(self):
+        # Converted records arrive faster than items can be built; attach a slice per tick to keep the UI live
+        tab = self.tab
+        pages = set()
+        for _ in range(min(IMPORT_BATCH, len(tab.import_queue))):
+            ann = tab.import_queue.popleft()
+            tab.import_keys.add(ann.pop('native_key'))
+            if 'type' not in ann:
+                continue
+            item = self._annotation_item(ann)
+            if item is None:
+                continue
+            self._attach_item(item, ann['page'], ann['layer'])
+            tab.native_items.add(item)
+            pages.add(ann['page'])
+        if IMPORTED_LAYER in self.layers and self.layer_list and self.layer_list.count() != len(self.layers):
+            self._refresh_layer_list()
+        for page_idx in pages:
+            if page_idx != tab.active_page and (tab, page_idx) in self.render_scheduler.resident:
+                tab.dirty_overlays.add(page_idx)
+        if tab.dirty_overlays:
+            self.overlay_timer.start()
+        if tab.import_queue:
+            self.import_timer.start()
+        else:
+            self._finish_import(tab)
+
+    def _import_finished(self, tab, worker):
+        if tab.importer is not worker:
+            return
+        tab.importer = None
+        self._finish_import(tab)
+
+    def _finish_import(self, tab):
+        if tab.importer or tab.import_queue:
+            return
+        imported = bool(tab.native_items)
+        tab.native_items.clear()
+        tab.native_keys |= tab.import_keys
+        tab.import_keys.clear()
+        if imported and tab is self.tab:
+            self.status.showMessage("Imported annotations stored in the PDF", 3000)
+
+    def _stop_import(self, tab):
+        if tab.importer:
+            tab.importer.requestInterruption()
+            tab.importer.wait()
+            tab.importer = None
+        tab.import_queue.clear()
+        tab.import_keys.clear()
+
+    def _annotations_changed(self, page_idx):
+        if page_idx in self.tab.overlays and page_idx != self.tab.active_page:
+            self.tab.dirty_overlays.add(page_idx)
+            self.overlay_timer.start()
+
+    def _refresh_overlays(self):
+        dirty, self.tab.dirty_overlays = self.tab.dirty_overlays, set()
+        for page_idx in dirty:
+            if page_idx != self.tab.active_page:
+                self._flatten_page(self.tab, page_idx)
+
+    def _activate_page(self, page_idx):
+        # The page being worked on shows live vector items; the previous one is flattened again
+        self.flatten_timer.stop()
+        tab = self.tab
+        if tab.active_page == page_idx:
+            return
+        previous, tab.active_page = tab.active_page, page_idx
+        self._unflatten_page(tab, page_idx)
+        if previous is not None:
+            self._flatten_page(tab, previous)
+
+    def _flatten_active_page(self):
+        tab = self.tab
+        if self.drawing or tab.active_page is None:
+            return
+        page_idx, tab.active_page = tab.active_page, None
+        self._flatten_page(tab, page_idx)
+
+    def _page_rendered(self, tab, page_idx):
+        if self.startup:
+            self.startup.mark("first page rendered")
+            self._startup_done()
+        if page_idx != tab.active_page:
+            self._flatten_page(tab, page_idx)
+
+    def _flatten_page(self, tab, page_idx):
+        annotations = tab.page_annotations.get(page_idx, {})
+        items = [item for item in annotations if _flattenable(item)]
+        if len(items) < FLATTEN_MIN_ITEMS or (tab, page_idx) not in self.render_scheduler.resident:
+            self._unflatten_page(tab, page_idx)
+            return
+        # One overlay per layer, a child of the layer's root, so it keeps the layer's place in the
+        # stacking order and follows its visibility and opacity without being painted again
+        by_layer = {}
+        for item in items:
+            by_layer.setdefault(annotations[item], []).append(item)
+        overlays = tab.overlays.setdefault(page_idx, {})
+        for name in list(overlays):
+            if name not in by_layer:
+                self._drop_overlay(tab, page_idx, overlays.pop(name))
+        # Flattened at the resolution the page itself is shown at, so it stays as sharp as the page
+        detail = tab.page_items[page_idx].detail
+        option = QtWidgets.QStyleOptionGraphicsItem()
+        for name, layer_items in by_layer.items():
+            rect = QtCore.QRectF()
+            for item in layer_items:
+                rect = rect.united(item.sceneBoundingRect())
+            # Only the area the layer's items cover, with a pixel to spare for antialiasing
+            rect = rect.toAlignedRect().adjusted(-1, -1, 1, 1)
+            pix = QtGui.QPixmap(int(rect.width() * detail), int(rect.height() * detail))
+            pix.fill(QtCore.Qt.transparent)
+            painter = QtGui.QPainter(pix)
+            painter.setRenderHints(QtGui.QPainter.Antialiasing)
+            to_overlay = QtGui.QTransform.fromTranslate(-rect.x(), -rect.y()) * QtGui.QTransform.fromScale(detail, detail)
+            for item in layer_items:
+                painter.setTransform(item.sceneTransform() * to_overlay)
+                item.paint(painter, option, None)
+            painter.end()
+            overlay = overlays.get(name)
+            if overlay is None:
+                overlay = overlays[name] = QtWidgets.QGraphicsPixmapItem(tab.layers[name].root)
+                overlay.setZValue(-1)
+            else:
+                self.render_scheduler.add_cost(tab, page_idx, -self._pixmap_cost(overlay.pixmap()))
+            overlay.setPixmap(pix)
+            overlay.setScale(1 / detail)
+            overlay.setPos(rect.topLeft())
+            self.render_scheduler.add_cost(tab, page_idx, self._pixmap_cost(pix))
+        for item in items:
+            item.hide()
+
+    def _drop_overlay(self, tab, page_idx, overlay):
+        self.render_scheduler.add_cost(tab, page_idx, -self._pixmap_cost(overlay.pixmap()))
+        tab.scene.removeItem(overlay)
+
+    def _unflatten_page(self, tab, page_idx):
+        overlays = tab.overlays.pop(page_idx, None)
+        if overlays is None:
+            return
+        for overlay in overlays.values():
+            self._drop_overlay(tab, page_idx, overlay)
+        for item in tab.page_annotations.get(page_idx, ()):
+            item.show()
+
+    def _pixmap_cost(self, pix):
+        return pix.width() * pix.height() * pix.depth() // 8
 
     def _get_page_at(self, pos):
-        for i, item in enumerate(self.page_items):
-            rect = item.sceneBoundingRect()
-            if rect.contains(pos):
-                return i
+        i = bisect.bisect_right(self.page_tops, pos.y()) - 1
+        if 0 <= i < len(self.page_items) and self.page_items[i].sceneBoundingRect().contains(pos):
+            return i
         return None
 
     def _select_tool(self, tool):
@@ -965,54 +3354,55 @@ class PDFAnnotator(QMainWindow):
         self.pen_width = value
 
     def _zoom(self, factor):
+        if self.view.recorder and self.view.recorder.active:
+            self.view.recorder.record_view("zoom", factor)
         self.scale *= factor
         self.view.scale(factor, factor)
+        self.render_scheduler.schedule()
         self._update_status()
 
     def undo(self):
-        if not self.history:
+        ops = self.undo_stack.undo()
+        if not ops:
             return
-        action, item, page_idx, layer = self.history.pop()
-        if action == "add":
-            self.scene.removeItem(item)
-            self.layers[layer].remove((item, page_idx))
-            self.redo_stack.append(("add", item, page_idx, layer))
-        elif action == "remove":
-            self.scene.addItem(item)
-            self.layers[layer].append((item, page_idx))
-            self.redo_stack.append(("remove", item, page_idx, layer))
+        for action, item, page_idx, layer in reversed(ops):
+            if action == "add":
+                self._detach_item(item, page_idx, layer)
+            elif action == "remove":
+                self._attach_item(item, page_idx, layer)
 
     def redo(self):
-        if not self.redo_stack:
+        ops = self.undo_stack.redo()
+        if not ops:
             return
-        action, item, page_idx, layer = self.redo_stack.pop()
-        if action == "add":
-            self.scene.addItem(item)
-            self.layers[layer].append((item, page_idx))
-            self.history.append(("add", item, page_idx, layer))
-        elif action == "remove":
-            self.scene.removeItem(item)
-            self.layers[layer].remove((item, page_idx))
-            self.history.append(("remove", item, page_idx, layer))
+        for action, item, page_idx, layer in ops:
+            if action == "add":
+                self._attach_item(item, page_idx, layer)
+            elif action == "remove":
+                self._detach_item(item, page_idx, layer)
 
     def clear_all(self):
+        self.render_scheduler.release(self.tab)
+        self.display_lists.release(self.tab)
+        self._reset_page_ops(self.tab)
         self.scene.clear()
         self.page_items.clear()
+        self.page_tops.clear()
         self.thumbnail_list.clear()
-        self.layers = {"Default": []}
-        self.layer_combo.clear()
-        self.layer_combo.addItem("Default")
-        self.history.clear()
-        self.redo_stack.clear()
+        self._reset_annotation_state()
+        self.current_layer = "Default"
+        self._refresh_layer_list()
+        self.undo_stack.clear()
         self._update_status()
 
     def fit_width(self):
         if self.page_items:
-            rect = self.page_items[0].pixmap().rect()
+            rect = self.page_items[0].boundingRect()
             view_width = self.view.viewport().width()
             self.scale = view_width / (rect.width() * self.render_zoom)
             self.view.resetTransform()
             self.view.scale(self.scale, self.scale)
+            self.render_scheduler.schedule()
             self._update_status()
 
     def fit_height(self):
@@ -1022,6 +3412,7 @@ class PDFAnnotator(QMainWindow):
             self.scale = view_height / rect.height()
             self.view.resetTransform()
             self.view.scale(self.scale, self.scale)
+            self.render_scheduler.schedule()
             self._update_status()
 
     def toggle_grid(self):
@@ -1059,6 +3450,325 @@ class PDFAnnotator(QMainWindow):
         value = self.view.verticalScrollBar().value()
         self.view.verticalScrollBar().setValue(value + self.view.viewport().height())
 
+    def _target_page(self):
+        # The page selected in the thumbnails, otherwise the one in the middle of the view
+        row = self.thumbnail_list.currentRow()
+        if row >= 0 and self.thumbnail_list.item(row).isSelected():
+            return row
+        return self._get_page_at(self.view.mapToScene(self.view.viewport().rect().center()))
+
+    def _page_op(self, op, before_relayout=None):
+        if not self.doc:
+            return
+        if self.tab.importer or self.tab.import_queue:
+            self.status.showMessage("Annotations stored in the PDF are still being imported", 3000)
+            return
+        try:
+            order, changed = _apply_page_op(self.doc, op)
+        except Exception as e:
+            QtWidgets.QMessageBox.critical(self, "Page Error", f"Failed to change pages: {str(e)}")
+            return
+        # Scene changes wait for the document edit to succeed; a failed one leaves the scene as it was
+        if before_relayout:
+            before_relayout()
+        self.tab.page_ops.append(op)
+        self._mark_dirty()
+        # A comparison is matched by page number, so it does not survive renumbering
+        self._clear_diff(self.tab)
+        # Outline destinations are page numbers too; the outline is read again from the edited document
+        self._reset_outline(self.tab)
+        self.text_cache.release(self.tab)
+        self._clear_selection()
+        # Cached rasters are keyed by page number in the file on disk until the change is saved
+        self.cache_key = None
+        self.undo_stack.clear()
+        self._relayout_pages(order, changed)
+        self._refresh_outline()
+        self._update_status()
+
+    def move_page(self, delta):
+        idx = self._target_page()
+        if idx is None or not 0 <= idx + delta < len(self.page_items):
+            return
+        self._page_op(("move", idx, idx + delta))
+        self._select_page(idx + delta)
+
+    def move_page_to(self):
+        idx = self._target_page()
+        if idx is None:
+            return
+        dst, ok = QInputDialog.getInt(self, "Move Page", f"Move page {idx + 1} to:", idx + 1, 1, len(self.page_items))
+        if ok and dst - 1 != idx:
+            self._page_op(("move", idx, dst - 1))
+            self._select_page(dst - 1)
+
+    def insert_pages(self):
+        if not self.doc:
+            return
+        path, _ = QFileDialog.getOpenFileName(self, "Insert Pages From PDF", "", "PDF Files (*.pdf)")
+        if not path:
+            return
+        idx = self._target_page()
+        at = len(self.page_items) if idx is None else idx + 1
+        self._page_op(("insert", path, at))
+        if self.tab.page_ops and self.tab.page_ops[-1] == ("insert", path, at):
+            self._import_native_annotations(path, at)
+
+    def delete_page(self):
+        idx = self._target_page()
+        if idx is None or len(self.page_items) < 2:
+            return
+        self._page_op(("delete", idx))
+
+    def rotate_page(self, angle):
+        idx = self._target_page()
+        if idx is None:
+            return
+        page = self.page_items[idx]
+        w, h = page.page_rect.width(), page.page_rect.height()
+        if angle == 90:
+            transform = QtGui.QTransform(0, 1, -1, 0, h, 0)
+        else:
+            transform = QtGui.QTransform(0, -1, 1, 0, 0, w)
+        def rotate_annotations():
+            self._unflatten_page(self.tab, idx)
+            for item in self.tab.page_annotations.get(idx, ()):
+                self._transform_item(item, page.pos(), transform)
+        self._page_op(("rotate", idx, angle), rotate_annotations)
+
+    def _transform_item(self, item, page_pos, transform):
+        # Annotation geometry is stored page-local, so the item's own coordinates are rewritten
+        self._mark_dirty(item)
+        if isinstance(item, InkStrokeItem):
+            item.map_points(transform)
+        elif isinstance(item, HighlightItem):
+            item.set_quads([transform.mapRect(q) for q in item.quads])
+        elif isinstance(item, QGraphicsPathItem):
+            item.setPath(transform.map(item.path()))
+        elif isinstance(item, QGraphicsLineItem):
+            item.setLine(transform.map(item.line()))
+        elif isinstance(item, (QGraphicsRectItem, QGraphicsEllipseItem)) and not item.toolTip():
+            item.setRect(transform.mapRect(item.rect()))
+        else:
+            item.setPos(page_pos + transform.map(item.pos() - page_pos))
+
+    def _select_page(self, idx):
+        if 0 <= idx < self.thumbnail_list.count():
+            self.thumbnail_list.setCurrentRow(idx)
+
+    def _relayout_pages(self, order, changed):
+        # Re-stack pages after a structure edit. Surviving pages keep their items, pixmaps,
+        # overlays and thumbnails; only pages whose position changed are moved, and only
+        # inserted or rotated pages are rendered again.
+        tab = self.tab
+        old_items = tab.page_items
+        mapping = {old: new for new, old in enumerate(order) if old is not None}
+        self.flatten_timer.stop()
+        for old, page in enumerate(old_items):
+            if old in mapping:
+                continue
+            self._unflatten_page(tab, old)
+            for item, layer_name in tab.page_annotations.pop(old, {}).items():
+                self.layers[layer_name].discard(item)
+            tab.scene.removeItem(page)
+        self.render_scheduler.remap(tab, mapping)
+        self.display_lists.remap(tab, mapping)
+
+        thumbs = [tab.thumbnail_list.takeItem(row) for row in range(tab.thumbnail_list.count() - 1, -1, -1)][::-1]
+        annotations, overlays = tab.page_annotations, tab.overlays
+        tab.page_annotations = {mapping[old]: anns for old, anns in annotations.items() if old in mapping}
+        tab.overlays = {mapping[old]: overlay for old, overlay in overlays.items() if old in mapping}
+        tab.dirty_overlays = {mapping[old] for old in tab.dirty_overlays if old in mapping}
+        tab.active_page = mapping.get(tab.active_page)
+        tab.thumbnailed = {mapping[old] for old in tab.thumbnailed if old in mapping and mapping[old] not in changed}
+        for layer in self.layers.values():
+            layer.items = {item: mapping[old] for item, old in layer.items.items()}
+
+        m = fitz.Matrix(self.render_zoom, self.render_zoom)
+        tab.page_items, tab.page_tops = [], []
+        y = 0
+        for new, old in enumerate(order):
+            if old is None or new in changed:
+                rect = (self.doc.load_page(new).rect * m).irect
+            if old is None:
+                page = PageItem(new, rect.width, rect.height)
+                page.setPos(0, y)
+                tab.scene.addItem(page)
+                thumb = QtWidgets.QListWidgetItem()
+            else:
+                page = old_items[old]
+                page.page_idx = new
+                thumb = thumbs[old]
+                if new in changed:
+                    self._unflatten_page(tab, new)
+                    self.render_scheduler.forget(tab, new)
+                    self.display_lists.forget(tab, new)
+                    page.prepareGeometryChange()
+                    page.page_rect = QtCore.QRectF(0, 0, rect.width, rect.height)
+                    page.setPixmap(QtGui.QPixmap())
+                    page.failed = False
+                    thumb.setIcon(QtGui.QIcon())
+                dy = y - page.pos().y()
+                if dy:
+                    page.setPos(0, y)
+                    for item in tab.page_annotations.get(new, ()):
+                        item.moveBy(0, dy)
+                    for overlay in tab.overlays.get(new, {}).values():
+                        overlay.moveBy(0, dy)
+            thumb.setText(f"Page {new+1}")
+            tab.thumbnail_list.addItem(thumb)
+            tab.page_items.append(page)
+            tab.page_tops.append(y)
+            y += page.page_rect.height() + 20
+        self.view.setSceneRect(self.scene.itemsBoundingRect())
+        self.render_scheduler.schedule()
+
+    def compare_pdf(self):
+        if not self.doc:
+            return
+        path, _ = QFileDialog.getOpenFileName(self, "Compare With PDF", os.path.dirname(self.pdf_path), "PDF Files (*.pdf)")
+        if not path:
+            return
+        tab = self.tab
+        self._clear_diff(tab)
+        worker = tab.differ = DiffWorker(tab.pdf_path, path, self)
+        worker.page_diffed.connect(lambda idx, ratio, rects: self._page_diffed(tab, worker, idx, rects))
+        worker.progress.connect(lambda done, total: self._diff_progress(tab, worker, path, done, total))
+        worker.compared.connect(lambda report: self._diff_finished(tab, worker, path, report))
+        worker.error.connect(lambda err: QtWidgets.QMessageBox.critical(self, "Compare Error", f"Failed to compare: {err}"))
+        worker.start()
+
+    def _diff_progress(self, tab, worker, path, done, total):
+        if tab.differ is worker and tab is self.tab:
+            self.status.showMessage(f"Comparing with {os.path.basename(path)}: {done}/{total} pages")
+
+    def _page_diffed(self, tab, worker, page_idx, rects):
+        if tab.differ is not worker or not rects or page_idx >= len(tab.page_items):
+            return
+        z = self.render_zoom
+        path = QtGui.QPainterPath()
+        for x0, y0, x1, y1 in rects:
+            path.addRect(x0 * z, y0 * z, (x1 - x0) * z, (y1 - y0) * z)
+        item = QGraphicsPathItem(path, tab.page_items[page_idx])
+        item.setPen(QtGui.QPen(QtCore.Qt.NoPen))
+        item.setBrush(QtGui.QColor(255, 40, 90, 90))
+        tab.diff_items[page_idx] = item
+
+    def _diff_finished(self, tab, worker, path, report):
+        if tab.differ is not worker:
+            return
+        tab.differ = None
+        tab.diff_ranking = report["ranking"]
+        extra = ""
+        if report["page_counts"][0] != report["page_counts"][1]:
+            extra = f"; page counts differ ({report['page_counts'][0]} vs {report['page_counts'][1]})"
+        self.status.showMessage(f"{report['changed_pages']} of {report['pages']} pages differ from "
+                                f"{os.path.basename(path)} ({report['wall_s']:.1f} s){extra}", 10000)
+        if tab is self.tab:
+            self._build_changes_panel()
+            self._refresh_changes_list()
+            self.changes_dock.show()
+
+    def _stop_diff(self, tab):
+        if tab.differ:
+            tab.differ.requestInterruption()
+            tab.differ.wait()
+            tab.differ = None
+
+    def _clear_diff(self, tab):
+        self._stop_diff(tab)
+        for item in tab.diff_items.values():
+            tab.scene.removeItem(item)
+        tab.diff_items = {}
+        tab.diff_ranking = []
+        if tab is self.tab:
+            self._refresh_changes_list()
+
+    def _build_changes_panel(self):
+        # Built the first time a comparison finishes
+        if self.changes_dock is not None:
+            return
+        self.changes_dock = QDockWidget("Changes", self)
+        self.changes_list = QListWidget()
+        self.changes_list.itemClicked.connect(lambda item: self._go_to_page(item.data(QtCore.Qt.UserRole)))
+        self.changes_dock.setWidget(self.changes_list)
+        self.addDockWidget(QtCore.Qt.RightDockWidgetArea, self.changes_dock)
+
+    def _refresh_changes_list(self):
+        if self.changes_dock is None:
+            return
+        self.changes_list.clear()
+        for page_idx, ratio in self.tab.diff_ranking:
+            item = QtWidgets.QListWidgetItem(f"Page {page_idx + 1}: {ratio * 100:.2f}% changed")
+            item.setData(QtCore.Qt.UserRole, page_idx)
+            self.changes_list.addItem(item)
+
+    def _go_to_page(self, idx):
+        if idx < len(self.page_items):
+            pos = self.page_items[idx].pos()
+            self.view.centerOn(pos.x(), pos.y())
+            self._select_page(idx)
+
+    def toggle_outline(self):
+        self._build_outline_panel()
+        if self.outline_dock.isVisible():
+            self.outline_dock.hide()
+        else:
+            self.outline_dock.show()
+            self.outline_dock.raise_()
+
+    def _build_outline_panel(self):
+        # Built the first time the outline is toggled on; no outline is read before that
+        if self.outline_dock is not None:
+            return
+        self.outline_dock = QDockWidget("Outline", self)
+        self.outline_tree = QtWidgets.QTreeView()
+        self.outline_tree.setHeaderHidden(True)
+        self.outline_tree.setUniformRowHeights(True)
+        self.outline_tree.clicked.connect(self._outline_activated)
+        self.outline_tree.activated.connect(self._outline_activated)
+        self.outline_dock.setWidget(self.outline_tree)
+        self.outline_dock.visibilityChanged.connect(lambda visible: visible and self._refresh_outline())
+        self.addDockWidget(QtCore.Qt.LeftDockWidgetArea, self.outline_dock)
+        self.tabifyDockWidget(self.thumbnail_dock, self.outline_dock)
+        self.outline_dock.hide()
+
+    def _refresh_outline(self):
+        if self.outline_dock is None or not self.outline_dock.isVisible():
+            return
+        tab = self.tab
+        if tab.outline_model is None and tab.doc is not None:
+            tab.outline_model = OutlineModel(tab.doc)
+            if not tab.outline_model.hasChildren():
+                self.status.showMessage("This document has no outline", 3000)
+        if self.outline_tree.model() is not tab.outline_model:
+            self.outline_tree.setModel(tab.outline_model)
+
+    def _reset_outline(self, tab):
+        if tab.outline_model is not None and self.outline_dock is not None \
+                and self.outline_tree.model() is tab.outline_model:
+            self.outline_tree.setModel(None)
+        tab.outline_model = None
+
+    def _outline_activated(self, index):
+        entry = self.tab.outline_model.entry(index) if self.tab.outline_model else None
+        if entry is None:
+            return
+        if entry.is_external:
+            if entry.uri:
+                QtGui.QDesktopServices.openUrl(QtCore.QUrl(entry.uri))
+            return
+        idx = entry.page
+        if not 0 <= idx < len(self.page_items):
+            return
+        # Destinations are in the page's displayed (rotated) space, the same space its pixmap is laid out in
+        x, y = entry.x, entry.y
+        x = 0 if math.isnan(x) else x
+        y = 0 if math.isnan(y) else y
+        pos = self.page_items[idx].pos()
+        self.view.jump_to(QtCore.QPointF(pos.x() + x * self.render_zoom, pos.y() + y * self.render_zoom))
+        self._select_page(idx)
+
     def _thumbnail_clicked(self, item):
         idx = self.thumbnail_list.row(item)
         if idx < len(self.page_items):
@@ -1066,14 +3776,159 @@ class PDFAnnotator(QMainWindow):
             self.view.centerOn(pos.x(), pos.y())
 
     def _change_layer(self, layer_name):
+        if layer_name not in self.layers:
+            return
         self.current_layer = layer_name
+        if self.layer_opacity is None:
+            return
+        self.layer_opacity.blockSignals(True)
+        self.layer_opacity.setValue(round(self.layers[layer_name].root.opacity() * 100))
+        self.layer_opacity.blockSignals(False)
+
+    def _ensure_layer(self, name):
+        layer = self.layers.get(name)
+        if layer is None:
+            layer = self.layers[name] = Layer(name, self.scene)
+            self._restack_layers()
+        return layer
+
+    def _restack_layers(self):
+        for z, layer in enumerate(self.layers.values()):
+            layer.root.setZValue(z)
+
+    def _refresh_layer_list(self):
+        if self.layer_list is None:
+            return
+        self.layer_list.blockSignals(True)
+        self.layer_list.clear()
+        for name, layer in reversed(list(self.layers.items())):
+            item = QtWidgets.QListWidgetItem(f"{name} 🔒" if layer.locked else name)
+            item.setData(QtCore.Qt.UserRole, name)
+            item.setFlags(item.flags() | QtCore.Qt.ItemIsUserCheckable)
+            item.setCheckState(QtCore.Qt.Checked if layer.visible else QtCore.Qt.Unchecked)
+            self.layer_list.addItem(item)
+            if name == self.current_layer:
+                self.layer_list.setCurrentItem(item)
+        self.layer_list.blockSignals(False)
+        self._change_layer(self.current_layer)
+
+    def _layers_repainted(self):
+        # Layer state is saved with the annotations; flattened overlays follow their layer's root
+        self._mark_dirty()
+
+    def _layer_item_changed(self, item):
+        layer = self.layers.get(item.data(QtCore.Qt.UserRole))
+        if layer and layer.visible != (item.checkState() == QtCore.Qt.Checked):
+            layer.root.setVisible(item.checkState() == QtCore.Qt.Checked)
+            self._layers_repainted()
+
+    def _set_layer_opacity(self, value):
+        self.layers[self.current_layer].root.setOpacity(value / 100)
+        self._layers_repainted()
 
     def _add_layer(self):
         name, ok = QInputDialog.getText(self, "New Layer", "Layer name:")
         if ok and name and name not in self.layers:
-            self.layers[name] = []
-            self.layer_combo.addItem(name)
-            self.layer_combo.setCurrentText(name)
+            self._ensure_layer(name)
+            self.current_layer = name
+            self._mark_dirty()
+            self._refresh_layer_list()
+
+    def _delete_layer(self):
+        if len(self.layers) < 2:
+            return
+        name = self.current_layer
+        layer = self.layers[name]
+        if layer.items and QtWidgets.QMessageBox.question(
+                self, "Delete Layer", f"Delete layer '{name}' and its {len(layer.items)} annotations?") != QtWidgets.QMessageBox.Yes:
+            return
+        self.undo_stack.begin()
+        for item, page_idx in list(layer.items.items()):
+            self._detach_item(item, page_idx, name)
+            self.undo_stack.push("remove", item, page_idx, name)
+        self.undo_stack.commit()
+        for page_idx, overlays in self.tab.overlays.items():
+            if name in overlays:
+                self._drop_overlay(self.tab, page_idx, overlays.pop(name))
+        self.scene.removeItem(layer.root)
+        del self.layers[name]
+        self._mark_dirty()
+        self.current_layer = list(self.layers)[-1]
+        self._restack_layers()
+        self._refresh_layer_list()
+
+    def _move_layer(self, delta):
+        names = list(self.layers)
+        i = names.index(self.current_layer)
+        j = i + delta
+        if not 0 <= j < len(names):
+            return
+        names[i], names[j] = names[j], names[i]
+        self.layers = {name: self.layers[name] for name in names}
+        self._restack_layers()
+        self._refresh_layer_list()
+        self._layers_repainted()
+
+    def _toggle_layer_lock(self):
+        layer = self.layers[self.current_layer]
+        layer.set_locked(not layer.locked)
+        self._mark_dirty()
+        self._refresh_layer_list()
+
+    def _toggle_recording(self, on):
+        if on:
+            view = self._recording_view = self.view
+            view.recorder = InputRecorder(self)
+            self._record_scroll = lambda *_: view.recorder.record_view(
+                "scroll", view.horizontalScrollBar().value(), view.verticalScrollBar().value())
+            view.horizontalScrollBar().valueChanged.connect(self._record_scroll)
+            view.verticalScrollBar().valueChanged.connect(self._record_scroll)
+            view.recorder.start()
+            self.status.showMessage("Recording input trace...")
+            return
+        view = getattr(self, "_recording_view", None)
+        if not view or not view.recorder:
+            return
+        view.horizontalScrollBar().valueChanged.disconnect(self._record_scroll)
+        view.verticalScrollBar().valueChanged.disconnect(self._record_scroll)
+        trace = view.recorder.stop()
+        view.recorder = None
+        self._recording_view = None
+        dest, _ = QFileDialog.getSaveFileName(self, "Save Input Trace", "", "Input Traces (*.trace.json)")
+        if not dest:
+            return
+        try:
+            with open(dest, 'w') as f:
+                json.dump(trace, f)
+            self.status.showMessage(f"Input trace saved to {dest} ({len(trace['events'])} events)", 3000)
+        except Exception as e:
+            QtWidgets.QMessageBox.critical(self, "Save Error", f"Failed to save trace: {str(e)}")
+
+    def replay_trace(self, path=None, speed=1.0, report=True):
+        if not path:
+            path, _ = QFileDialog.getOpenFileName(self, "Replay Input Trace", "", "Input Traces (*.trace.json *.json)")
+            if not path:
+                return
+        try:
+            with open(path, 'r') as f:
+                trace = json.load(f)
+        except Exception as e:
+            QtWidgets.QMessageBox.critical(self, "Replay Error", f"Failed to read trace: {str(e)}")
+            return
+        self._replayer = InputReplayer(self, trace, speed, self)
+        if report:
+            self._replayer.finished.connect(self._show_replay_report)
+        self._replayer.start()
+        return self._replayer
+
+    def _show_replay_report(self, report):
+        lines = [f"Events: {report['events']}  Wall time: {report['wall_time']:.2f}s"]
+        for key, title in (("processing_ms", "Processing"), ("paint_latency_ms", "Paint latency")):
+            stats = report[key]
+            if stats:
+                lines.append(f"{title}: p50 {stats['p50']:.2f} ms, p95 {stats['p95']:.2f} ms, "
+                             f"p99 {stats['p99']:.2f} ms, max {stats['max']:.2f} ms")
+        QtWidgets.QMessageBox.information(self, "Replay Report", "\n".join(lines))
 
     def _update_status(self):
         status = f"Scale: {self.scale:.2%}"
@@ -1081,11 +3936,156 @@ class PDFAnnotator(QMainWindow):
             status += f" | File: {os.path.basename(self.pdf_path)} | Pages: {self.doc.page_count if self.doc else 0}"
         self.status.showMessage(status)
 
+    def closeEvent(self, ev):
+        buttons = QtWidgets.QMessageBox.Save | QtWidgets.QMessageBox.Discard | QtWidgets.QMessageBox.Cancel
+        for tab in self._tabs():
+            if tab.doc and not self._save_before_close(tab, buttons):
+                ev.ignore()
+                return
+        if self._image_export_worker:
+            self._image_export_worker.requestInterruption()
+            self._image_export_worker.wait()
+        if self._save_worker:
+            self._save_worker.wait()
+        for tab in self._tabs():
+            self._stop_import(tab)
+            self._stop_diff(tab)
+        for tab in self._tabs() + self._closed_tabs:
+            self._finish_saving(tab)
+        self._closed_tabs = []
+        self.page_cache.close()
+        super().closeEvent(ev)
+
     def show_about(self):
         QtWidgets.QMessageBox.about(self, "About", "OpenPDF\nVersion 3.2.8\nBy Team Emogi")
 
+def _size_summary(report):
+    before, after = report["input_bytes"], report["output_bytes"]
+    stages = ", ".join(f"{name} {ms:.0f} ms" for name, ms in report["stages_ms"].items())
+    return (f"{before / 1e6:.2f} MB -> {after / 1e6:.2f} MB ({(after - before) / before * 100 if before else 0:+.0f}%) "
+            f"with the {report['profile']} profile in {report['total_ms'] / 1000:.2f} s ({stages})")
+
+def _read_sidecar(pdf_path):
+    # Returns the saved annotations for pdf_path and the keys of the PDF annotations they replace
+    annotation_path = os.path.splitext(pdf_path)[0] + '.annotations.json'
+    if not os.path.exists(annotation_path):
+        return [], set()
+    with open(annotation_path) as f:
+        data = json.load(f)
+    if isinstance(data, list):
+        return data, set()
+    if 'native_keys' not in data and data.get('native_imported', False):
+        # Older sidecars only recorded that everything convertible had been imported
+        with fitz.open(pdf_path) as doc:
+            return data.get('annotations', []), _native_keys(doc)
+    return data.get('annotations', []), set(data.get('native_keys', ()))
+
+def compare_cli(argv):
+    parser = argparse.ArgumentParser(prog="OpenPDF.py --compare",
+                                     description="Rank the pages of two PDF revisions by how much of each changed.")
+    parser.add_argument("old")
+    parser.add_argument("new")
+    parser.add_argument("--dpi", type=int, default=DIFF_DPI)
+    parser.add_argument("--threshold", type=int, default=DIFF_THRESHOLD)
+    parser.add_argument("--jobs", type=int, default=None, help="worker processes (default: one per CPU)")
+    parser.add_argument("--report", help="write the ranking and timings to this JSON file")
+    args = parser.parse_args(argv)
+    worker = DiffWorker(args.old, args.new, dpi=args.dpi, threshold=args.threshold, jobs=args.jobs)
+    result = {}
+    worker.error.connect(lambda err: result.setdefault('error', err))
+    worker.compared.connect(result.update)
+    worker.run()
+    if 'error' in result:
+        print(f"Compare failed: {result['error']}", file=sys.stderr)
+        return 1
+    for idx, ratio in result['ranking']:
+        print(f"page {idx + 1:5d}  {ratio * 100:6.2f}% changed")
+    print(f"{result['changed_pages']} of {result['pages']} pages differ; compared in {result['wall_s']:.2f} s "
+          f"on {result['jobs']} processes (p50 {result['page_ms'].get('p50', 0):.1f} ms per page)")
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(result, f, indent=2)
+    return 0
+
+def export_pdf_cli(argv):
+    parser = argparse.ArgumentParser(prog="OpenPDF.py --export-pdf",
+                                     description="Write a copy of a PDF with its saved annotations, optimized for size or speed.")
+    parser.add_argument("pdf")
+    parser.add_argument("output")
+    parser.add_argument("--profile", choices=list(EXPORT_PROFILES), default="balanced")
+    parser.add_argument("--linearize", action="store_true", help="optimize for fast web view")
+    parser.add_argument("--report", help="write sizes and stage timings to this JSON file")
+    args = parser.parse_args(argv)
+    annotations, native_keys = _read_sidecar(args.pdf)
+    worker = SaveWorker(args.output, args.pdf, annotations, RENDER_ZOOM, native_keys=native_keys,
+                        profile=args.profile, linearize=args.linearize)
+    result = {}
+    worker.error.connect(lambda err: result.setdefault('error', err))
+    worker.report.connect(result.update)
+    worker.run()
+    if 'error' in result:
+        print(f"Export failed: {result['error']}", file=sys.stderr)
+        return 1
+    print(f"{args.output}: {_size_summary(result)}")
+    if args.linearize and not result['linearized']:
+        print("Linearization is not supported by this PyMuPDF build; the file was saved without it.", file=sys.stderr)
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(result, f, indent=2)
+    return 0
+
+def export_images_cli(argv):
+    parser = argparse.ArgumentParser(prog="OpenPDF.py --export-images",
+                                     description="Render every page of a PDF, with its saved annotations, to image files.")
+    parser.add_argument("pdf")
+    parser.add_argument("out_dir")
+    parser.add_argument("--dpi", type=int, default=EXPORT_DPI)
+    parser.add_argument("--format", choices=list(IMAGE_FORMATS), default="png")
+    parser.add_argument("--quality", type=int, default=90, help="JPEG quality")
+    parser.add_argument("--jobs", type=int, default=None, help="worker processes (default: one per CPU)")
+    parser.add_argument("--report", help="write per-page timings to this JSON file")
+    args = parser.parse_args(argv)
+    annotations, native_keys = _read_sidecar(args.pdf)
+    worker = ImageExportWorker(args.out_dir, args.pdf, annotations, RENDER_ZOOM, native_keys=native_keys,
+                               dpi=args.dpi, fmt=args.format, quality=args.quality, jobs=args.jobs)
+    result = {}
+    worker.page_done.connect(lambda idx, dest, seconds: print(f"page {idx + 1:5d}  {seconds * 1000:8.1f} ms  {dest}"))
+    worker.error.connect(lambda err: result.setdefault('error', err))
+    worker.exported.connect(result.update)
+    worker.run()
+    if 'error' in result:
+        print(f"Export failed: {result['error']}", file=sys.stderr)
+        return 1
+    page_ms = result['page_ms']
+    print(f"{result['pages']} pages at {result['dpi']} DPI in {result['wall_s']:.2f} s on {result['jobs']} processes "
+          f"({result['pages_per_s']:.1f} pages/s, p50 {page_ms.get('p50', 0):.1f} ms, p95 {page_ms.get('p95', 0):.1f} ms per page)")
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(result, f, indent=2)
+    return 0
+
 if __name__ == "__main__":
-    app = QApplication(sys.argv)
-    win = PDFAnnotator()
+    if sys.argv[1:2] in (["--export-images"], ["--export-pdf"], ["--compare"]):
+        _load_pymupdf()
+    if sys.argv[1:2] == ["--export-images"]:
+        sys.exit(export_images_cli(sys.argv[2:]))
+    if sys.argv[1:2] == ["--export-pdf"]:
+        sys.exit(export_pdf_cli(sys.argv[2:]))
+    if sys.argv[1:2] == ["--compare"]:
+        sys.exit(compare_cli(sys.argv[2:]))
+    parser = argparse.ArgumentParser(prog="OpenPDF.py")
+    parser.add_argument("files", nargs="*", help="PDF files to open")
+    parser.add_argument("--startup-timing", action="store_true", help="print where startup time goes, up to the first rendered page")
+    parser.add_argument("--exit-after-startup", action="store_true", help="quit once startup has finished (with --startup-timing)")
+    args, qt_args = parser.parse_known_args()
+    startup = None
+    if args.startup_timing:
+        startup = StartupTimer(args.exit_after_startup)
+        startup.mark("modules imported")
+    app = QApplication(sys.argv[:1] + qt_args)
+    if startup:
+        startup.mark("QApplication created")
+    win = PDFAnnotator(startup)
     win.show()
+    QtCore.QTimer.singleShot(0, lambda: win.finish_startup(args.files))
     sys.exit(app.exec_())
@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+# Headless benchmark suite for OpenPDF.
+#
+#   python benchmarks/bench.py --pages 10 100 --output results.json
+#   python benchmarks/bench.py --compare results.json
+#
+# Runs PDFAnnotator under the offscreen Qt platform against synthetic documents
+# and records wall time and peak memory for each stage as JSON.
+import os, sys, json, time, argparse, platform, tempfile, threading, tracemalloc
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PyQt5 import QtCore, QtGui, QtWidgets
+from PyQt5.QtWidgets import QApplication
+import fitz  # PyMuPDF
+
+DEFAULT_PAGES = [10, 100]
+DEFAULT_KINDS = ["text", "image"]
+LOREM = ("Lorem ipsum dolor sit amet, consectetur adipiscing elit, sed do eiusmod tempor "
+         "incididunt ut labore et dolore magna aliqua. Ut enim ad minim veniam, quis nostrud ")
+
+def _rss():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+class MemorySampler:
+    # Polls RSS in the background so native (Qt/MuPDF) allocations are counted too
+    def __init__(self, interval=0.01, trace_python=False):
+        self.interval = interval
+        self.trace_python = trace_python
+        self.peak = None
+        self.py_peak = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        self.start_rss = _rss()
+        self.peak = self.start_rss
+        if self.trace_python:
+            tracemalloc.start()
+        if self.start_rss is not None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.is_set():
+            rss = _rss()
+            if rss is not None and rss > self.peak:
+                self.peak = rss
+            self._stop.wait(self.interval)
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        rss = _rss()
+        if rss is not None and self.peak is not None:
+            self.peak = max(self.peak, rss)
+        if self.trace_python:
+            self.py_peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        return False
+
+def make_pdf(path, pages, kind):
+    doc = fitz.open()
+    if kind == "image":
+        samples = bytearray(os.urandom(600 * 800 * 3))
+        pm = fitz.Pixmap(fitz.csRGB, 600, 800, samples, False)
+        image = pm.tobytes("png")
+    for i in range(pages):
+        page = doc.new_page(width=595, height=842)
+        if kind == "image":
+            page.insert_image(fitz.Rect(36, 36, 559, 806), stream=image)
+            page.insert_text((40, 30), f"Page {i + 1}", fontsize=12)
+        else:
+            y = 40
+            while y < 800:
+                page.insert_text((36, y), LOREM, fontsize=8)
+                y += 11
+    doc.save(path, garbage=4, deflate=True)
+    doc.close()
+
+def make_annotations(pages, per_page, page_size=(595, 842)):
+    w, h = page_size
+    annotations = []
+    for page in range(pages):
+        for n in range(per_page):
+            x = 40 + (n * 37) % int(w - 120)
+            y = 40 + (n * 53) % int(h - 120)
+            kind = n % 5
+            if kind == 0:
+                stroke = [[x + i * 2.0, y + (i % 7) * 1.5] for i in range(40)]
+                annotations.append({'layer': 'Default', 'page': page, 'type': 'path', 'strokes': [stroke],
+                                    'color': [1.0, 1.0, 0.0], 'width': 4})
+            elif kind == 1:
+                annotations.append({'layer': 'Default', 'page': page, 'type': 'line', 'points': [x, y, x + 60, y + 30],
+                                    'color': [1.0, 0.0, 0.0], 'width': 3})
+            elif kind == 2:
+                annotations.append({'layer': 'Review', 'page': page, 'type': 'rect', 'rect': [x, y, 80, 40],
+                                    'color': [0.0, 0.6, 1.0], 'width': 2})
+            elif kind == 3:
+                annotations.append({'layer': 'Review', 'page': page, 'type': 'ellipse', 'rect': [x, y, 50, 50],
+                                    'color': [0.0, 1.0, 0.0], 'width': 2})
+            else:
+                annotations.append({'layer': 'Default', 'page': page, 'type': 'text', 'data': [x, y, f"Note {n}", 12],
+                                    'color': [1.0, 1.0, 1.0]})
+    return annotations
+
+def _raise_on_dialog(parent, title, text, *args, **kwargs):
+    # Modal message boxes would block forever offscreen; surface them as failures instead
+    raise RuntimeError(f"{title}: {text}")
+
+class FakeEvent:
+    def __init__(self, x, y):
+        self._pos = QtCore.QPoint(int(x), int(y))
+
+    def pos(self):
+        return self._pos
+
+    def posF(self):
+        return QtCore.QPointF(self._pos)
+
+    def pressure(self):
+        return 0.6
+
+    def button(self):
+        return QtCore.Qt.LeftButton
+
+class Runner:
+    def __init__(self, app, workdir, repeat=1, trace_python=False):
+        self.app = app
+        self.workdir = workdir
+        self.repeat = repeat
+        self.trace_python = trace_python
+        self.results = []
+
+    def measure(self, case, stage, func, **extra):
+        best = None
+        for _ in range(self.repeat):
+            with MemorySampler(trace_python=self.trace_python) as mem:
+                start = time.perf_counter()
+                func()
+                elapsed = time.perf_counter() - start
+            if best is None or elapsed < best["seconds"]:
+                best = {"case": case, "stage": stage, "seconds": elapsed,
+                        "peak_rss_mb": None if mem.peak is None else (mem.peak - mem.start_rss) / 2**20,
+                        "peak_python_mb": None if mem.py_peak is None else mem.py_peak / 2**20}
+        best.update(extra)
+        self.results.append(best)
+        print(f"  {stage:<20} {best['seconds'] * 1000:10.1f} ms"
+              + ("" if best["peak_rss_mb"] is None else f"  {best['peak_rss_mb']:8.1f} MB rss")
+              + ("" if best["peak_python_mb"] is None else f"  {best['peak_python_mb']:8.1f} MB py"), flush=True)
+        return best
+
+    def drain(self, win):
+        # Let the render scheduler finish the pages it wants for the current viewport
+        self.app.processEvents()
+        while not win.render_scheduler.is_idle():
+            self.app.processEvents()
+
+    def run_case(self, pages, kind, per_page, strokes):
+        import OpenPDF
+        case = f"{kind}-{pages}p"
+        print(f"{case} ({per_page} annotations/page)", flush=True)
+        pdf_path = os.path.join(self.workdir, f"{case}.pdf")
+        ann_path = os.path.splitext(pdf_path)[0] + '.annotations.json'
+        if not os.path.exists(pdf_path):
+            make_pdf(pdf_path, pages, kind)
+        with open(ann_path, 'w') as f:
+            json.dump(make_annotations(pages, per_page), f)
+
+        win = OpenPDF.PDFAnnotator()
+        win.autosave_timer.stop()
+        win.page_cache = OpenPDF.PageCache(tempfile.mkdtemp(prefix="cache-", dir=self.workdir))
+        win.show()
+        self.app.processEvents()
+
+        def load():
+            win._load_pdf(pdf_path)
+            self.drain(win)
+        self.measure(case, "load_pdf", load, pages=pages)
+        win.page_cache.flush()
+        # Opening a path that is already open only switches to its tab, so close it first
+        win.close_tab(win.tab_widget.currentIndex())
+        self.measure(case, "reopen_pdf", load, pages=pages)
+
+        def scroll():
+            bar = win.view.verticalScrollBar()
+            image = QtGui.QImage(win.view.viewport().size(), QtGui.QImage.Format_RGB32)
+            step = max(1, win.view.viewport().height() // 4)
+            value = 0
+            while value <= bar.maximum():
+                bar.setValue(value)
+                self.drain(win)
+                painter = QtGui.QPainter(image)
+                win.view.render(painter)
+                painter.end()
+                self.app.processEvents()
+                value += step
+        self.measure(case, "scroll", scroll)
+
+        def capture():
+            win.view.verticalScrollBar().setValue(0)
+            win._select_tool("pen")
+            for s in range(strokes):
+                x0, y0 = 40 + (s * 13) % 300, 40 + (s * 17) % 300
+                win._start_tool(FakeEvent(x0, y0))
+                for i in range(1, 60):
+                    win._move_tool(FakeEvent(x0 + i * 3, y0 + (i % 9) * 2))
+                win._end_tool(FakeEvent(x0 + 180, y0))
+        self.measure(case, "stroke_capture", capture, strokes=strokes)
+
+        collected = []
+        self.measure(case, "collect_annotations", lambda: collected.append(win.collect_annotations()),
+                     annotations=pages * per_page + strokes)
+        annotations = collected[-1]
+
+        def save():
+            win.save_annotations()
+            worker = win.tab.save_worker
+            if worker is not None:
+                worker.wait()
+        self.measure(case, "save_annotations", save)
+
+        def export():
+            errors = []
+            worker = OpenPDF.SaveWorker(os.path.join(self.workdir, f"{case}-export.pdf"), pdf_path,
+                                        annotations, win.render_zoom)
+            worker.error.connect(errors.append)
+            worker.run()
+            if errors:
+                raise RuntimeError(errors[0])
+        self.measure(case, "export_pdf", export)
+
+        def reload_annotations():
+            win._clear_annotations()
+            win._load_annotations()
+        self.measure(case, "load_annotations", reload_annotations)
+
+        win.close()
+        win.deleteLater()
+        self.app.processEvents()
+
+def environment():
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "qt": QtCore.QT_VERSION_STR,
+        "pymupdf": getattr(fitz, "VersionBind", None),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+def compare(old_path, results, threshold):
+    with open(old_path) as f:
+        old = {(r["case"], r["stage"]): r for r in json.load(f)["results"]}
+    regressions = 0
+    print(f"\n{'case':<16}{'stage':<22}{'old ms':>10}{'new ms':>10}{'change':>9}")
+    for r in results:
+        prev = old.get((r["case"], r["stage"]))
+        if not prev or not prev["seconds"]:
+            continue
+        change = r["seconds"] / prev["seconds"] - 1
+        flag = "  REGRESSION" if change > threshold else ""
+        regressions += bool(flag)
+        print(f"{r['case']:<16}{r['stage']:<22}{prev['seconds'] * 1000:10.1f}{r['seconds'] * 1000:10.1f}{change:+9.1%}{flag}")
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="OpenPDF headless benchmarks")
+    parser.add_argument("--pages", type=int, nargs="+", default=DEFAULT_PAGES, help="page counts (10 to 5000)")
+    parser.add_argument("--kinds", nargs="+", choices=DEFAULT_KINDS, default=DEFAULT_KINDS)
+    parser.add_argument("--annotations-per-page", type=int, default=20)
+    parser.add_argument("--strokes", type=int, default=200, help="pen strokes replayed in stroke_capture")
+    parser.add_argument("--repeat", type=int, default=1, help="keep the best of N runs per stage")
+    parser.add_argument("--trace-python", action="store_true",
+                        help="also record peak Python heap (tracemalloc slows pure-Python stages down)")
+    parser.add_argument("--workdir", help="where synthetic PDFs are generated (reused between runs)")
+    parser.add_argument("--output", help="write results as JSON")
+    parser.add_argument("--compare", help="previous JSON results to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10, help="relative slowdown reported as regression")
+    args = parser.parse_args(argv)
+
+    app = QApplication.instance() or QApplication(sys.argv[:1])
+    QtWidgets.QMessageBox.critical = _raise_on_dialog
+    QtWidgets.QMessageBox.warning = _raise_on_dialog
+    workdir = args.workdir or tempfile.mkdtemp(prefix="openpdf-bench-")
+    os.makedirs(workdir, exist_ok=True)
+    runner = Runner(app, workdir, args.repeat, args.trace_python)
+    for kind in args.kinds:
+        for pages in args.pages:
+            runner.run_case(pages, kind, args.annotations_per_page, args.strokes)
+
+    report = {"environment": environment(), "results": runner.results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults written to {args.output}")
+    if args.compare:
+        return 1 if compare(args.compare, runner.results, args.threshold) else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
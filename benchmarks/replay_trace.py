@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+# Replays a recorded input trace (Tools > Record Input Trace) against a PDF headlessly
+# and reports per-event processing time and paint latency percentiles.
+#
+#   python benchmarks/replay_trace.py session.trace.json drawing.pdf --speed 4 --output report.json
+import os, sys, json, argparse
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PyQt5.QtWidgets import QApplication
+import OpenPDF
+
+def replay(app, trace_path, pdf_path, speed):
+    win = OpenPDF.PDFAnnotator()
+    win.autosave_timer.stop()
+    win.show()
+    win._load_pdf(pdf_path)
+    app.processEvents()
+    reports = []
+    replayer = win.replay_trace(trace_path, speed, report=False)
+    replayer.finished.connect(reports.append)
+    replayer.finished.connect(app.quit)
+    app.exec_()
+    win.close()
+    return reports[0]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay an OpenPDF input trace")
+    parser.add_argument("trace")
+    parser.add_argument("pdf")
+    parser.add_argument("--speed", type=float, default=1.0, help="1 = recorded timing, 0 = as fast as possible")
+    parser.add_argument("--output", help="write the report as JSON")
+    args = parser.parse_args(argv)
+
+    app = QApplication.instance() or QApplication(sys.argv[:1])
+    report = replay(app, args.trace, args.pdf, args.speed)
+    for key in ("processing_ms", "paint_latency_ms"):
+        stats = report[key]
+        if stats:
+            print(f"{key:<18}" + "  ".join(f"{name} {value:8.2f}" for name, value in stats.items()))
+    print(f"{report['events']} events in {report['wall_time']:.2f}s, {report['unpainted_events']} never painted")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
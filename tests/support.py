@@ -0,0 +1,49 @@
+# Shared setup for the behaviour tests: an offscreen QApplication and a PDFAnnotator with a document open.
+#
+#   python -m unittest discover -s tests
+import os, sys, time
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PyQt5 import QtWidgets
+from PyQt5.QtWidgets import QApplication
+
+import OpenPDF
+
+_app = None
+
+def app():
+    # Held at module level: a QApplication that gets collected takes the widgets down with it
+    global _app
+    _app = QApplication.instance() or QApplication([])
+    return _app
+
+def settle(window, timeout=10.0):
+    # Let the import and save workers finish and their queued signals arrive
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        app().processEvents()
+        tab = window.tab
+        if tab is None or not (tab.importer or tab.import_queue or tab.saving):
+            break
+        time.sleep(0.01)
+    app().processEvents()
+
+def open_window(pdf_path):
+    app()
+    window = OpenPDF.PDFAnnotator()
+    window.show()
+    window.finish_startup([])
+    window._load_pdf(pdf_path)
+    settle(window)
+    return window
+
+def close_window(window):
+    # Nothing is left to ask about: unsaved state is discarded
+    question = QtWidgets.QMessageBox.question
+    QtWidgets.QMessageBox.question = staticmethod(lambda *a, **k: QtWidgets.QMessageBox.Discard)
+    try:
+        window.close()
+        app().processEvents()
+    finally:
+        QtWidgets.QMessageBox.question = question
@@ -0,0 +1,94 @@
+import os, json, shutil, tempfile, unittest
+
+import fitz
+
+from support import app, open_window, close_window, settle, OpenPDF
+
+def _shapes_pdf(path):
+    doc = fitz.open()
+    page = doc.new_page(width=400, height=600)
+    annot = page.add_rect_annot(fitz.Rect(50, 50, 150, 120))
+    annot.set_border(width=3)
+    annot.set_colors(stroke=(1, 0, 0))
+    annot.update()
+    page.add_circle_annot(fitz.Rect(200, 50, 300, 150)).update()
+    page.add_freetext_annot(fitz.Rect(50, 300, 250, 350), "hello", fontsize=12).update()
+    doc.save(path)
+    doc.close()
+
+class NativeImportTest(unittest.TestCase):
+    def setUp(self):
+        app()
+        self.dir = tempfile.mkdtemp()
+        self.pdf_path = os.path.join(self.dir, "shapes.pdf")
+        _shapes_pdf(self.pdf_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _records(self, window):
+        return sorted(window.collect_annotations(), key=lambda ann: ann['type'])
+
+    def assertSameGeometry(self, first, second):
+        self.assertEqual([ann['type'] for ann in first], [ann['type'] for ann in second])
+        for a, b in zip(first, second):
+            for key in ('rect', 'data', 'size', 'width', 'rotate'):
+                self.assertEqual(key in a, key in b, f"{a['type']} {key}")
+                if key in a:
+                    values = a[key] if isinstance(a[key], list) else [a[key]]
+                    other = b[key] if isinstance(b[key], list) else [b[key]]
+                    for x, y in zip(values, other):
+                        if isinstance(x, str):
+                            self.assertEqual(x, y)
+                        else:
+                            self.assertAlmostEqual(x, y, places=2, msg=f"{a['type']} {key}")
+
+    def test_export_round_trip_keeps_geometry(self):
+        window = open_window(self.pdf_path)
+        try:
+            records = self._records(window)
+            self.assertEqual([ann['type'] for ann in records], ['ellipse', 'rect', 'text'])
+            self.assertEqual(len(window.tab.native_keys), 3)
+            doc = OpenPDF._annotated_doc(self.pdf_path, records, window.render_zoom, window.tab.native_keys)
+        finally:
+            close_window(window)
+        # The editable copies replace the originals instead of being stacked on top of them
+        self.assertEqual(sorted(annot.type[1] for annot in doc[0].annots()), ['Circle', 'FreeText', 'Square'])
+        exported = os.path.join(self.dir, "exported.pdf")
+        doc.save(exported)
+        doc.close()
+
+        window = open_window(exported)
+        try:
+            self.assertSameGeometry(records, self._records(window))
+        finally:
+            close_window(window)
+
+    def test_reopen_imports_only_new_annotations(self):
+        window = open_window(self.pdf_path)
+        try:
+            window._mark_dirty()
+            window.save_annotations()
+            window._wait_for_saves(window.tab)
+        finally:
+            close_window(window)
+        with open(os.path.splitext(self.pdf_path)[0] + ".annotations.json") as f:
+            self.assertEqual(len(json.load(f)['native_keys']), 3)
+
+        # Another application adds an annotation to the PDF after the sidecar was written
+        doc = fitz.open(self.pdf_path)
+        doc[0].add_rect_annot(fitz.Rect(100, 400, 200, 500)).update()
+        doc.saveIncr()
+        doc.close()
+
+        window = open_window(self.pdf_path)
+        try:
+            settle(window)
+            records = window.collect_annotations()
+            self.assertEqual(sorted(ann['type'] for ann in records), ['ellipse', 'rect', 'rect', 'text'])
+            self.assertEqual(len(window.tab.native_keys), 4)
+        finally:
+            close_window(window)
+
+if __name__ == "__main__":
+    unittest.main()
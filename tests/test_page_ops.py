@@ -0,0 +1,90 @@
+import os, shutil, tempfile, unittest
+
+import fitz
+from PyQt5 import QtWidgets
+from PyQt5.QtWidgets import QGraphicsRectItem
+
+from support import app, open_window, close_window, OpenPDF
+
+class PageOpRelayoutTest(unittest.TestCase):
+    def setUp(self):
+        app()
+        self.dir = tempfile.mkdtemp()
+        pdf_path = os.path.join(self.dir, "pages.pdf")
+        doc = fitz.open()
+        for _ in range(3):
+            doc.new_page(width=400, height=600)
+        doc.save(pdf_path)
+        doc.close()
+        self.window = open_window(pdf_path)
+        # One marker per page, tagged with the page it was drawn on
+        self.markers = []
+        for idx, page in enumerate(self.window.page_items):
+            item = QGraphicsRectItem(20, 20, 100, 50)
+            item.setPos(page.pos())
+            item.setData(0, idx)
+            self.window._attach_item(item, idx, "Default")
+            self.markers.append(item)
+
+    def tearDown(self):
+        close_window(self.window)
+        shutil.rmtree(self.dir)
+
+    def assertLayout(self, expected):
+        # expected lists, for each page now in the document, the original page its marker came from
+        window = self.window
+        self.assertEqual(len(window.page_items), len(expected))
+        y = 0
+        for idx, page in enumerate(window.page_items):
+            self.assertEqual(page.page_idx, idx)
+            self.assertEqual(window.page_tops[idx], y)
+            self.assertEqual(page.pos().y(), y)
+            y += page.page_rect.height() + 20
+            items = list(window.tab.page_annotations.get(idx, {}))
+            self.assertEqual([item.data(0) for item in items], [expected[idx]])
+            self.assertEqual(window.layers["Default"].items[items[0]], idx)
+            self.assertTrue(page.sceneBoundingRect().contains(items[0].sceneBoundingRect()))
+        self.assertEqual(set(window.tab.page_annotations), set(range(len(expected))))
+
+    def test_rotate_moves_following_pages(self):
+        window = self.window
+        window._select_page(0)
+        window.rotate_page(90)
+        self.assertEqual(window.tab.page_ops, [("rotate", 0, 90)])
+        page = window.page_items[0]
+        self.assertEqual((page.page_rect.width(), page.page_rect.height()), (600 * window.render_zoom, 400 * window.render_zoom))
+        self.assertLayout([0, 1, 2])
+
+    def test_move_and_delete_keep_annotations_with_pages(self):
+        window = self.window
+        window._select_page(2)
+        window.move_page(-2)
+        self.assertLayout([2, 0, 1])
+        window._select_page(1)
+        window.delete_page()
+        self.assertLayout([2, 1])
+        self.assertIsNone(self.markers[0].scene())
+        self.assertEqual(window.tab.page_ops, [("move", 2, 0), ("delete", 1)])
+
+    def test_failed_op_leaves_scene_unchanged(self):
+        window = self.window
+        before = [(item.sceneBoundingRect(), item.rect()) for item in self.markers]
+        errors = []
+        apply_page_op, critical = OpenPDF._apply_page_op, QtWidgets.QMessageBox.critical
+        def fail(doc, op):
+            raise RuntimeError("disk full")
+        OpenPDF._apply_page_op = fail
+        QtWidgets.QMessageBox.critical = staticmethod(lambda *a, **k: errors.append(a[2]))
+        try:
+            window._select_page(0)
+            window.rotate_page(90)
+            window.delete_page()
+        finally:
+            OpenPDF._apply_page_op, QtWidgets.QMessageBox.critical = apply_page_op, critical
+        self.assertEqual(len(errors), 2)
+        self.assertEqual(window.tab.page_ops, [])
+        self.assertEqual([(item.sceneBoundingRect(), item.rect()) for item in self.markers], before)
+        self.assertLayout([0, 1, 2])
+
+if __name__ == "__main__":
+    unittest.main()
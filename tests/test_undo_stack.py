@@ -0,0 +1,49 @@
+import unittest
+
+from PyQt5.QtWidgets import QGraphicsRectItem, QGraphicsTextItem
+
+from support import app, OpenPDF
+
+class UndoStackMemoryTest(unittest.TestCase):
+    def setUp(self):
+        app()
+
+    def test_oldest_transactions_evicted_at_limit(self):
+        stack = OpenPDF.UndoStack(memory_limit=256 * 10)
+        items = [QGraphicsRectItem(0, 0, 10, 10) for _ in range(50)]
+        for item in items:
+            stack.push("add", item, 0, "Default")
+            self.assertLessEqual(stack.memory_used, stack.memory_limit)
+        self.assertEqual(len(stack._undo), 10)
+        self.assertEqual(stack.memory_used, sum(cost for _, cost in stack._undo))
+        # Undo walks back through the newest transactions only
+        undone = [stack.undo()[0][1] for _ in range(10)]
+        self.assertEqual(undone, items[:-11:-1])
+        self.assertIsNone(stack.undo())
+        self.assertIs(stack.redo()[0][1], items[40])
+
+    def test_oversized_transaction_is_kept(self):
+        stack = OpenPDF.UndoStack(memory_limit=300)
+        stack.push("add", QGraphicsRectItem(0, 0, 10, 10), 0, "Default")
+        big = QGraphicsTextItem("x" * 1000)
+        stack.push("add", big, 0, "Default")
+        # The newest gesture stays undoable even when it alone exceeds the limit
+        self.assertEqual(len(stack._undo), 1)
+        self.assertIs(stack.undo()[0][1], big)
+
+    def test_new_edit_releases_redo_memory(self):
+        stack = OpenPDF.UndoStack(memory_limit=10000)
+        stack.begin()
+        for _ in range(3):
+            stack.push("add", QGraphicsRectItem(0, 0, 10, 10), 0, "Default")
+        stack.commit()
+        self.assertEqual(stack.memory_used, 3 * 256)
+        stack.undo()
+        stack.push("add", QGraphicsRectItem(0, 0, 10, 10), 0, "Default")
+        self.assertEqual(stack.memory_used, 256)
+        self.assertIsNone(stack.redo())
+        stack.clear()
+        self.assertEqual(stack.memory_used, 0)
+
+if __name__ == "__main__":
+    unittest.main()